@@ -1,73 +1,219 @@
 import os
 import sys
 import queue
-import sounddevice as sd
-import vosk
+try:
+    import sounddevice as sd
+except OSError: # PortAudio is missing (e.g. a CI machine): only the headless modes work
+    sd = None
 import json
 import subprocess
 import numpy as np
 # import soundfile as sf # Soundfile might not be strictly needed
 import io
+import random
+import string
+import itertools
+import functools
+import math
+import struct
+import re
 import datetime
 import time
-import requests # For download helper
-from tqdm import tqdm # For download helper progress bar
-import zipfile # For extraction
-import tarfile # For extraction
+import types
+import wave
+import hashlib
+import atexit
+import shutil
+import argparse
+import tempfile
+import threading
+import collections
+import contextlib
+import concurrent.futures
 import traceback # For detailed error printing
 
 # --- Configuration ---
 # (Configuration section remains the same as your working version)
 VOSK_MODEL_PATH = "vosk-model-small-fr-0.22/vosk-model-small-fr-0.22"
-VOSK_MODEL_URL = "https://alphacephei.com/vosk/models/vosk-model-small-fr-0.22.zip"
-VOSK_MODEL_ZIP = "vosk-model-small-fr-0.22.zip"
-PIPER_EXE_PATH = "piper_windows_amd64/piper/piper.exe"
-PIPER_URL_LINUX = "https://github.com/rhasspy/piper/releases/download/2023.11.14-1/piper_linux_x86_64.tar.gz"
-PIPER_URL_WINDOWS = "https://github.com/rhasspy/piper/releases/download/2023.11.14-1/piper_windows_x86_64.zip"
-PIPER_DOWNLOAD_URL = PIPER_URL_WINDOWS
-PIPER_ARCHIVE_NAME = os.path.basename(PIPER_DOWNLOAD_URL)
+# Download URLs and checksums live in models_manifest.json (see --provision); these paths must match its "creates"/"path".
+if sys.platform == "win32":
+    PIPER_EXE_PATH = "piper_windows_amd64/piper/piper.exe"
+else:
+    PIPER_EXE_PATH = "piper_linux_x86_64/piper/piper"
 PIPER_VOICE_MODEL = "fr-fr-siwis-medium.onnx" # Or fr-FR- if you changed script instead of files
 PIPER_VOICE_JSON = "fr-fr-siwis-medium.onnx.json" # Or fr-FR-
-PIPER_VOICE_URL_ONNX = None
-PIPER_VOICE_URL_JSON = None
 INPUT_DEVICE = None
 OUTPUT_DEVICE = None
 SAMPLE_RATE = 16000
 VOSK_SAMPLE_RATE = 16000
 PIPER_SAMPLE_RATE = 22050
-BLOCK_SIZE = 8000
+BLOCK_SIZE = 1600 # Frames per AcceptWaveform call (100 ms; 8000 used to add up to half a second of latency)
+VAD_ENABLED = True # Skip decoding during silence and finalize on trailing silence
+VAD_MIN_RMS = 300 # int16 RMS below which a 20 ms frame is never speech
+VAD_NOISE_RATIO = 3.0 # Speech must be this many times louder than the tracked noise floor
+VAD_MAX_ZCR = 0.5 # Frames crossing zero more often than this are hiss, not voice
+VAD_MIN_SPEECH_FRAMES = 2 # Speech frames a block needs to count as speech
+VAD_PREROLL_BLOCKS = 3 # Silent blocks kept and decoded when speech starts, so onsets are not clipped
+ENDPOINT_SILENCE_MS = 500 # Trailing silence that ends an utterance (with the VAD on)
+CAPTURE_BLOCK_SIZE = 320 # The microphone delivers 20 ms blocks so barge-in can react within ~100 ms (decoding still uses BLOCK_SIZE)
+OUTPUT_BLOCK_SECONDS = 0.02 # Playback callback granularity; bounds how long a cancelled reply keeps playing
+BARGE_IN = True # Let the user interrupt a reply by speaking
+BARGE_IN_RMS_THRESHOLD = 1500 # int16 RMS of a 20 ms frame that counts as speech during playback
+BARGE_IN_ECHO_RATIO = 1.0 # The microphone must also be this many times louder than the reply being played, so the speakers' echo does not trigger it
+BARGE_IN_ECHO_WINDOW_MS = 300 # Playback history the microphone is compared with; covers output plus input latency
+BARGE_IN_MIN_SPEECH_MS = 60 # Continuous speech required before playback is cut
+BARGE_IN_PREROLL_MS = 500 # Audio kept from before the trigger so the start of the interruption is transcribed
+CAPTURE_RING_SECONDS = 30 # Capacity of the preallocated capture ring; beyond this backlog new audio is dropped
+METRICS_HOST = "127.0.0.1" # Address of the --metrics-port endpoint; "0.0.0.0" exposes it to the network
+METRICS_DUMP_SECONDS = 60 # Histogram snapshot interval for --metrics-jsonl
+PROFILE_INTERVAL = 0.01 # Seconds between stack samples with --profile
+STT_SERVER_HOST = "0.0.0.0"
+STT_SERVER_PORT = 2700
+STT_SERVER_THREADS = os.cpu_count() or 4 # Bounded pool running AcceptWaveform for all sessions
+STT_SERVER_MAX_FRAME_BYTES = 1024 * 1024
+BATCH_CHUNK_FRAMES = 16000 # Frames read from disk per step in batch mode (the file is never loaded whole)
+RESAMPLER_TAPS_PER_PHASE = 32 # Polyphase filter length per phase; more taps = sharper anti-aliasing, more CPU
+OUTPUT_SAMPLE_RATES = (48000, 44100, 16000) # Tried in order when the output device rejects the voice's own rate
+OUTPUT_RESAMPLE_CHUNK_FRAMES = 4096 # Voice samples resampled per step when the device runs at another rate
+PIPER_WORKERS = 1 # Number of warm Piper processes kept running (more = parallel synthesis)
+PIPER_WORKER_TIMEOUT = 30 # Seconds allowed for one utterance before the worker is killed and restarted
+TTS_CACHE_DIR = "tts_cache" # Pre-rendered replies as raw int16 files, reused across restarts
+TTS_CACHE_MEMORY_BYTES = 64 * 1024 * 1024 # In-memory LRU budget for cached audio
+REPLAY_TRAILING_SILENCE_SECONDS = 1.5 # Silence after each scripted utterance in headless replay, enough to endpoint it
+STUB_TTS_SECONDS_PER_CHAR = 0.06 # Length of the stand-in audio produced by --stub-tts
+BENCH_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json") # Stored results --bench-conversations compares against
+BENCH_REGRESSION_TOLERANCE = 0.25 # A metric this much worse than its baseline fails the benchmark
 ASSISTANT_NAME = "Assistant IT" # Changed name slightly
+INTENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents_fr.json") # Keywords and responses
+STT_GRAMMAR = False # Decode against a phrase list built from the intent keywords, open vocabulary only as fallback
+GRAMMAR_MIN_CONFIDENCE = 0.7 # Mean word confidence below which the grammar result is re-decoded with the open vocabulary
+INTENTS_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents_fr_corpus.jsonl") # Expected routing
+MODELS_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models_manifest.json") # Artifacts for --provision
+PROVISION_WORKERS = 4 # Artifacts downloaded at the same time
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024 # Read and write size for downloads
+DOWNLOAD_RETRIES = 3 # Attempts per artifact; each one resumes where the previous one stopped
+DOWNLOAD_TIMEOUT = 30 # Seconds without data before a download attempt is abandoned
 
 # --- Helper Functions (download_file, extract_archive) ---
-# (These functions remain the same)
-def download_file(url, filename):
-    print(f"Downloading {os.path.basename(filename)} from {url}...")
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        total_size = int(response.headers.get('content-length', 0))
-        block_size = 1024
-        t = tqdm(total=total_size, unit='iB', unit_scale=True, desc=f"Downloading {os.path.basename(filename)}")
-        with open(filename, 'wb') as f:
-            for data in response.iter_content(block_size):
-                t.update(len(data))
+# requests, tqdm, zipfile and tarfile are imported where they are used, so the assistant does not pay for them at startup.
+def sha256_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+class ChunkReader(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks, so tarfile can extract while downloading."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            data = next(self.chunks, None)
+            if data is None:
+                return 0
+            self.pending = memoryview(data)
+        count = min(len(buffer), len(self.pending))
+        buffer[:count] = self.pending[:count]
+        self.pending = self.pending[count:]
+        return count
+
+def _download_chunks(url, part_path, progress):
+    """Yields the bytes of `url` from the start: first whatever `part_path` already holds, then the rest,
+    fetched with an HTTP Range request and appended to `part_path`."""
+    import requests
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with requests.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+        complete = offset > 0 and response.status_code == 416 # Nothing left past the end of the partial file...
+        if complete:
+            size = response.headers.get("Content-Range", "").rpartition("/")[2] # "bytes */<size>"
+            if size != str(offset): # ...unless it is larger than the file, or the size cannot be confirmed
+                os.remove(part_path)
+                raise requests.exceptions.HTTPError(f"partial download ({offset} bytes) does not match the file "
+                                                    f"({size or 'unknown'} bytes); starting over")
+        else:
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                offset = 0 # The server ignored the Range header: start over
+        progress.reset(total=offset + int(response.headers.get('content-length', 0) if not complete else 0) or None)
+        progress.update(offset)
+        if offset:
+            with open(part_path, 'rb') as f:
+                yield from iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b'')
+        if complete:
+            return
+        with open(part_path, 'ab' if offset else 'wb', buffering=DOWNLOAD_CHUNK_BYTES) as f:
+            for data in response.iter_content(DOWNLOAD_CHUNK_BYTES):
                 f.write(data)
-        t.close()
-        if total_size != 0 and t.n != total_size:
-            print("ERROR: Download incomplete.")
+                progress.update(len(data))
+                yield data
+
+def download_file(url, filename, sha256=None, consume=None, position=None):
+    """Downloads `url` to `filename`, resuming from `filename`.part after an interruption.
+
+    The SHA-256 is checked when given. `consume`, if set, is called with the
+    chunks as they arrive (to extract while downloading) and must return a
+    true value on success. Returns True once `filename` is complete.
+    """
+    import requests
+    from tqdm import tqdm
+    part_path = filename + ".part"
+    if os.path.exists(filename):
+        if consume is None and (sha256 is None or sha256_file(filename) == sha256):
+            print(f"{os.path.basename(filename)} already downloaded.")
+            return True
+        os.replace(filename, part_path) # Feed it to `consume` again, or re-verify it, as a complete partial download
+    print(f"Downloading {os.path.basename(filename)} from {url}...")
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        hasher = hashlib.sha256()
+        def hashed(chunks):
+            for data in chunks:
+                hasher.update(data)
+                yield data
+        try:
+            with tqdm(unit='iB', unit_scale=True, desc=f"Downloading {os.path.basename(filename)}", position=position) as t, \
+                 contextlib.closing(hashed(_download_chunks(url, part_path, t))) as chunks:
+                if consume is not None and not consume(chunks):
+                    print(f"Attempt {attempt}/{DOWNLOAD_RETRIES} for {os.path.basename(filename)} failed.")
+                    continue
+                for _ in chunks: # Whatever `consume` left unread, e.g. padding after the end of a tar archive
+                    pass
+                if t.total and t.n != t.total:
+                    print(f"ERROR: Download incomplete (attempt {attempt}/{DOWNLOAD_RETRIES}).")
+                    continue
+        except requests.exceptions.RequestException as e:
+            print(f"Error downloading {os.path.basename(filename)} (attempt {attempt}/{DOWNLOAD_RETRIES}): {e}")
+            continue
+        except Exception as e:
+            print(f"An unexpected error occurred during download: {e}")
             return False
-        print(f"{os.path.basename(filename)} downloaded successfully.")
+        digest = hasher.hexdigest()
+        if sha256 is not None and digest != sha256:
+            print(f"ERROR: SHA-256 mismatch for {os.path.basename(filename)} (expected {sha256}, got {digest}); discarding it.")
+            os.remove(part_path)
+            continue
+        os.replace(part_path, filename)
+        print(f"{os.path.basename(filename)} downloaded successfully." +
+              ("" if sha256 else f" Its SHA-256 is {digest}; pin it in the manifest to verify future downloads."))
         return True
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading {os.path.basename(filename)}: {e}")
-        return False
-    except Exception as e:
-         print(f"An unexpected error occurred during download: {e}")
-         return False
+    return False
 
-def extract_archive(archive_path, extract_to='.'):
+def extract_archive(archive_path, extract_to='.', fileobj=None):
+    """Extracts a .zip or .tar.gz archive. A .tar.gz can also be read from `fileobj` as a stream
+    (e.g. a ChunkReader over a download in progress); a .zip has to be complete on disk."""
+    import zipfile
+    import tarfile
     print(f"Extracting {archive_path}...")
     extracted_content_path = None
+    # Refuse absolute paths, '..' and links out of the target directory where Python supports it.
+    tar_options = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
     try:
         if archive_path.endswith(".zip"):
             with zipfile.ZipFile(archive_path, 'r') as zip_ref:
@@ -78,8 +224,8 @@ def extract_archive(archive_path, extract_to='.'):
                  else:
                      extracted_content_path = extract_to
         elif archive_path.endswith(".tar.gz"):
-            with tarfile.open(archive_path, "r:gz") as tar_ref:
-                 tar_ref.extractall(path=extract_to)
+            with (tarfile.open(fileobj=fileobj, mode="r|gz") if fileobj is not None else tarfile.open(archive_path, "r:gz")) as tar_ref:
+                 tar_ref.extractall(path=extract_to, **tar_options)
                  potential_path = os.path.join(extract_to, os.path.splitext(os.path.splitext(os.path.basename(archive_path))[0])[0])
                  if os.path.isdir(potential_path):
                      extracted_content_path = potential_path
@@ -97,282 +243,1677 @@ def extract_archive(archive_path, extract_to='.'):
          print(f"An unexpected error occurred during extraction: {e}")
          return None
 
+# --- Model Provisioning ---
+def load_manifest(path=MODELS_MANIFEST_PATH):
+    """Artifacts from the provisioning manifest that apply to this platform."""
+    with open(path, 'r', encoding='utf-8') as f:
+        artifacts = json.load(f)["artifacts"]
+    return [entry for entry in artifacts if sys.platform.startswith(entry.get("platform", ""))]
+
+def provision_artifact(entry, position=None, allow_unpinned=False):
+    """Makes one manifest entry present: a plain file at "path", or an archive extracted into "extract_to".
+
+    Work already done is skipped. Archives are extracted into a staging
+    directory that only replaces "extract_to" once everything checked out.
+    Entries without a "sha256" are only downloaded with `allow_unpinned`.
+    """
+    name, url, sha256 = entry["name"], entry["url"], entry.get("sha256")
+    if sha256 is None and not allow_unpinned and not os.path.exists(entry.get("creates") or entry["path"]):
+        print(f"{name}: no sha256 in the manifest, so the download cannot be verified. "
+              "Pin it, or re-run with --allow-unpinned to accept it unverified.")
+        return False
+    if "extract_to" not in entry:
+        return download_file(url, entry["path"], sha256, position=position)
+    if os.path.exists(entry["creates"]):
+        print(f"{name}: already provisioned ('{entry['creates']}' exists).")
+        return True
+    archive_path = os.path.basename(url)
+    staging = entry["extract_to"] + ".partial"
+    if archive_path.endswith(".tar.gz"):
+        def extract_while_downloading(chunks):
+            shutil.rmtree(staging, ignore_errors=True) # A retry streams the archive again from its first byte
+            return extract_archive(archive_path, staging, fileobj=ChunkReader(chunks))
+        ok = download_file(url, archive_path, sha256, consume=extract_while_downloading, position=position)
+    else:
+        # The zip directory is at the end of the file, so zips are extracted once complete.
+        ok = download_file(url, archive_path, sha256, position=position) and extract_archive(archive_path, staging)
+    if not ok:
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+    shutil.rmtree(entry["extract_to"], ignore_errors=True)
+    os.replace(staging, entry["extract_to"])
+    os.remove(archive_path)
+    if not os.path.exists(entry["creates"]):
+        print(f"WARNING: {name}: '{entry['creates']}' not found after extraction; check the manifest.")
+        return False
+    return True
+
+def run_provisioning(manifest_path=MODELS_MANIFEST_PATH, workers=PROVISION_WORKERS, allow_unpinned=False):
+    """Fetches every artifact of the manifest concurrently; returns the number of failures."""
+    artifacts = load_manifest(manifest_path)
+    print(f"--- Provisioning {len(artifacts)} artifact(s) from '{manifest_path}' ---")
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="provision") as executor:
+        results = list(executor.map(functools.partial(provision_artifact, allow_unpinned=allow_unpinned),
+                                    artifacts, range(len(artifacts))))
+    failures = [entry["name"] for entry, ok in zip(artifacts, results) if not ok]
+    print(f"Provisioning finished in {time.perf_counter() - start:.1f}s: {len(artifacts) - len(failures)} ready"
+          + (f", failed: {', '.join(failures)}." if failures else "."))
+    return len(failures)
+
 # --- Prerequisite Checks ---
-# (This section remains the same)
-print("--- Checking Prerequisites ---")
-print(f"Current Working Directory: {os.getcwd()}")
-if not os.path.isdir(VOSK_MODEL_PATH):
-    print(f"Vosk model not found at '{VOSK_MODEL_PATH}'.")
-    # (Add download/extract logic here if needed, simplified for brevity)
-    sys.exit("Vosk model missing.")
-else:
-    print(f"Vosk model found at '{VOSK_MODEL_PATH}'.")
-if not os.path.exists(PIPER_EXE_PATH):
-    print(f"Piper executable not found at '{PIPER_EXE_PATH}'.")
-     # (Add download/extract logic here if needed, simplified for brevity)
-    sys.exit("Piper executable missing.")
-else:
-     print(f"Piper executable found at '{PIPER_EXE_PATH}'.")
-print("--- Checking Piper Voice Files ---")
-if os.path.exists(PIPER_VOICE_MODEL):
-    print(f"Piper voice model found at '{PIPER_VOICE_MODEL}'.")
-else:
-    print(f"ERROR: Piper voice model (.onnx) *NOT FOUND* at '{PIPER_VOICE_MODEL}'.")
-    sys.exit(f"Missing required file: {PIPER_VOICE_MODEL}")
-if os.path.exists(PIPER_VOICE_JSON):
-    print(f"Piper voice config found at '{PIPER_VOICE_JSON}'.")
-else:
-    print(f"WARNING: Piper voice config (.json) *NOT FOUND* at '{PIPER_VOICE_JSON}'.")
+def check_prerequisites(stt=True, tts=True):
+    """Exits with a message when a model or executable needed by the selected mode is missing."""
+    print("--- Checking Prerequisites ---")
+    print(f"Current Working Directory: {os.getcwd()}")
+    if stt:
+        if not os.path.isdir(VOSK_MODEL_PATH):
+            print(f"Vosk model not found at '{VOSK_MODEL_PATH}'. Run 'python assistant_fr.py --provision' to download it.")
+            sys.exit("Vosk model missing.")
+        else:
+            print(f"Vosk model found at '{VOSK_MODEL_PATH}'.")
+    if not tts:
+        return
+    if not os.path.exists(PIPER_EXE_PATH):
+        print(f"Piper executable not found at '{PIPER_EXE_PATH}'. Run 'python assistant_fr.py --provision' to download it.")
+        sys.exit("Piper executable missing.")
+    else:
+        print(f"Piper executable found at '{PIPER_EXE_PATH}'.")
+    print("--- Checking Piper Voice Files ---")
+    if os.path.exists(PIPER_VOICE_MODEL):
+        print(f"Piper voice model found at '{PIPER_VOICE_MODEL}'.")
+    else:
+        print(f"ERROR: Piper voice model (.onnx) *NOT FOUND* at '{PIPER_VOICE_MODEL}'. Run 'python assistant_fr.py --provision' to download it.")
+        sys.exit(f"Missing required file: {PIPER_VOICE_MODEL}")
+    if os.path.exists(PIPER_VOICE_JSON):
+        print(f"Piper voice config found at '{PIPER_VOICE_JSON}'.")
+    else:
+        print(f"WARNING: Piper voice config (.json) *NOT FOUND* at '{PIPER_VOICE_JSON}'.")
+
+# --- TTS Engine (persistent Piper workers) ---
+def read_wav(path):
+    """Reads a mono 16-bit WAV file straight into an int16 array and returns (samples, sample rate)."""
+    with open(path, 'rb') as f, wave.open(f, 'rb') as wav_file:
+        sample_rate = wav_file.getframerate()
+        samples = np.empty(wav_file.getnframes(), dtype=np.int16)
+        # wave leaves the file positioned at the first sample, so the data is read without an intermediate bytes copy.
+        count = f.readinto(memoryview(samples).cast('B'))
+    return samples[:count // 2], sample_rate
+
+class PiperWorker:
+    """A long-lived Piper process with the voice model loaded once.
+
+    Each request is one JSON line on stdin; Piper writes the utterance to the
+    given WAV file and echoes its path on stdout, which frames the reply.
+    """
+
+    def __init__(self, worker_id, work_dir):
+        self.worker_id = worker_id
+        self.work_dir = work_dir
+        self.process = None
+        self.requests_served = 0
+        self.restarts = -1 # The first start() is not a restart
+        self.stderr_tail = collections.deque(maxlen=20)
+
+    def start(self):
+        command = [PIPER_EXE_PATH, '--model', PIPER_VOICE_MODEL, '--json-input', '--output_dir', self.work_dir]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.restarts += 1
+        # Piper logs to stderr continuously; drain it so the pipe never fills up and blocks the worker.
+        threading.Thread(target=self._drain_stderr, args=(self.process,), daemon=True).start()
+
+    def _drain_stderr(self, process):
+        for line in process.stderr:
+            self.stderr_tail.append(line.decode('utf-8', errors='ignore').rstrip())
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def synthesize(self, text):
+        self.requests_served += 1
+        output_file = os.path.join(self.work_dir, f"worker{self.worker_id}_{self.requests_served}.wav")
+        request = json.dumps({"text": text, "output_file": output_file}, ensure_ascii=False)
+        # A hung worker is killed by the watchdog, which turns the blocking readline into EOF.
+        watchdog = threading.Timer(PIPER_WORKER_TIMEOUT, self.process.kill)
+        watchdog.start()
+        try:
+            self.process.stdin.write((request + "\n").encode('utf-8'))
+            self.process.stdin.flush()
+            reply = self.process.stdout.readline()
+        finally:
+            watchdog.cancel()
+        if not reply:
+            stderr_output = "\n".join(self.stderr_tail)
+            raise RuntimeError(f"Piper worker {self.worker_id} exited (code {self.process.poll()}). Piper stderr:\n{stderr_output}")
+        wav_path = reply.decode('utf-8', errors='ignore').strip() or output_file
+        try:
+            return read_wav(wav_path)
+        finally:
+            if os.path.exists(wav_path):
+                os.remove(wav_path)
+
+class AudioCache:
+    """Content-addressed PCM cache for synthesized segments.
+
+    Keys hash the voice model, its sample rate and the text. Hot entries live in
+    an in-memory LRU bounded by bytes; every entry is also kept on disk as a raw
+    int16 file that is memory-mapped on read, so the cache survives restarts.
+    """
+
+    def __init__(self, cache_dir, voice_model, voice_config, max_memory_bytes=TTS_CACHE_MEMORY_BYTES):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.sample_rate = PIPER_SAMPLE_RATE
+        if os.path.exists(voice_config):
+            with open(voice_config, 'r', encoding='utf-8') as f:
+                self.sample_rate = json.load(f).get("audio", {}).get("sample_rate", PIPER_SAMPLE_RATE)
+        voice_hash = hashlib.sha256()
+        for path in (voice_model, voice_config):
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        voice_hash.update(block)
+        self.voice_hash = voice_hash.hexdigest()
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.voice_hash}\0{self.sample_rate}\0{text}".encode('utf-8')).hexdigest()
+
+    def _remember(self, key, audio):
+        # Caller holds self.lock
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        self.memory[key] = audio
+        self.memory_bytes += audio.nbytes
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def get(self, text):
+        """Returns the cached int16 samples for text, or None."""
+        key = self.key(text)
+        with self.lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return audio
+        path = os.path.join(self.cache_dir, key + ".pcm")
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with self.lock:
+                self.misses += 1
+            return None
+        audio = np.memmap(path, dtype=np.int16, mode='r')
+        with self.lock:
+            self._remember(key, audio)
+            self.hits += 1
+        return audio
+
+    def put(self, text, audio, sample_rate):
+        if audio.size == 0 or sample_rate != self.sample_rate:
+            return
+        key = self.key(text)
+        path = os.path.join(self.cache_dir, key + ".pcm")
+        # Write under a temporary name so a crash never leaves a truncated entry behind.
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        audio.astype(np.int16, copy=False).tofile(temp_path)
+        os.replace(temp_path, path)
+        with self.lock:
+            self._remember(key, audio)
+
+class TTSEngine:
+    """A pool of warm Piper workers; speak() is a thin client of this."""
+
+    def __init__(self, num_workers=PIPER_WORKERS, cache=None, worker_class=PiperWorker):
+        self.cache = cache
+        self.output_rate = None # Set once the output device rate is known; replies are then resampled to it
+        self.work_dir = tempfile.mkdtemp(prefix="piper_tts_")
+        self.workers = [worker_class(i, self.work_dir) for i in range(max(1, num_workers))]
+        self.idle_workers = queue.Queue()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.workers), thread_name_prefix="piper")
+        self.pending = set() # Queued segments, cancelled by close() (shutdown(cancel_futures=) needs Python 3.9)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start() # The processes load the voice in parallel
+        for worker in self.workers:
+            # The first utterance pays for ONNX session setup; do it now rather than on the first reply.
+            worker.synthesize("Bonjour.")
+            self.idle_workers.put(worker)
+
+    def synthesize(self, text):
+        """Returns (int16 samples, sample rate), restarting the worker once if it crashed."""
+        worker = self.idle_workers.get()
+        try:
+            for attempt in range(2):
+                if not worker.alive():
+                    print(f"Piper worker {worker.worker_id} is not running, restarting it.")
+                    worker.start()
+                try:
+                    return worker.synthesize(text)
+                except (OSError, RuntimeError, wave.Error) as e:
+                    print(f"Piper worker {worker.worker_id} failed: {e}")
+                    worker.stop()
+            raise RuntimeError(f"Piper worker {worker.worker_id} failed twice, giving up on this utterance.")
+        finally:
+            self.idle_workers.put(worker)
+
+    def render(self, text, store=False):
+        """Like synthesize(), but served from the cache when possible.
+
+        Only static text should be stored; templated replies such as the time
+        would just fill the cache with entries that never repeat.
+        """
+        if self.cache is not None:
+            audio = self.cache.get(text)
+            if audio is not None:
+                return audio, self.cache.sample_rate
+        audio, sample_rate = self.synthesize(text)
+        if store and self.cache is not None:
+            self.cache.put(text, audio, sample_rate)
+        return audio, sample_rate
+
+    def _render_for_output(self, text, store):
+        audio, sample_rate = self.render(text, store) # The cache keeps the voice's own rate
+        if self.output_rate is None or sample_rate == self.output_rate or audio.size == 0:
+            return audio, sample_rate
+        return resample_audio(audio, sample_rate, self.output_rate), self.output_rate
+
+    def synthesize_stream(self, segments, store=False):
+        """Yields (int16 samples, sample rate) for each segment in order.
+
+        All segments are queued up front, so later ones are synthesized while
+        the caller is still playing the earlier ones.
+        """
+        futures = [self.executor.submit(self._render_for_output, segment, store) for segment in segments]
+        for future in futures:
+            self.pending.add(future)
+            future.add_done_callback(self.pending.discard)
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        for future in list(self.pending):
+            future.cancel()
+        self.executor.shutdown(wait=False)
+        for worker in self.workers:
+            worker.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+# --- Capture Ring Buffer ---
+_vosk_ffi = None # Vosk's cffi handle, used to pass our buffers to the decoder in place; resolved once Vosk is loaded
+
+def vosk_ffi():
+    """Vosk's cffi handle, or None while Vosk has not been imported (stub backends never import it)."""
+    global _vosk_ffi
+    if _vosk_ffi is None and "vosk" in sys.modules:
+        _vosk_ffi = getattr(sys.modules["vosk"], "_ffi", None)
+    return _vosk_ffi
+
+def as_waveform(view):
+    """Wraps a buffer for AcceptWaveform without copying it (Vosk's binding otherwise only takes bytes)."""
+    ffi = vosk_ffi()
+    return ffi.from_buffer(view) if ffi is not None else bytes(view)
+
+def waveform_buffer(data):
+    """Buffer-protocol view of what as_waveform() returned, for recognizers written in Python."""
+    if _vosk_ffi is not None and isinstance(data, _vosk_ffi.CData):
+        return _vosk_ffi.buffer(data)
+    return data
+
+class AudioRingBuffer:
+    """Preallocated single-producer / single-consumer ring of int16 samples.
+
+    The capture callback (producer) copies each block in without allocating;
+    the listener (consumer) reads memoryviews straight out of the ring. Both
+    sides only advance their own counter, so the normal path needs no lock.
+    When the consumer falls behind, new frames are dropped and counted as an
+    overrun instead of memory growing without bound.
+
+    While a reply plays nobody consumes, so the ring is switched to overwrite
+    mode: the producer then drops the *oldest* frames, under `lock`, and only
+    the latest audio is kept for barge-in.
+    """
+
+    def __init__(self, capacity_frames, sample_rate=VOSK_SAMPLE_RATE):
+        self.buffer = np.zeros(capacity_frames, dtype=np.int16)
+        self.capacity = capacity_frames
+        self.sample_rate = sample_rate
+        self.scratch = np.zeros(capacity_frames, dtype=np.int16) # Only for reads that wrap around the end
+        self.write_index = 0 # Frames ever written; advanced by the producer only
+        self.read_index = 0 # Frames ever consumed; advanced by the consumer only (or under lock)
+        self.overwrite = False
+        self.lock = threading.Lock()
+        self.data_ready = threading.Event()
+        self.overruns = 0
+        self.dropped_frames = 0
+
+    def available(self):
+        return self.write_index - self.read_index
+
+    def backlog_seconds(self):
+        return self.available() / self.sample_rate
+
+    def write(self, samples):
+        """Producer side: copies int16 samples into the ring."""
+        if self.overwrite:
+            with self.lock:
+                samples = samples[-self.capacity:]
+                excess = self.available() + len(samples) - self.capacity
+                if excess > 0:
+                    self.read_index += excess
+                self._store(samples)
+        else:
+            free = self.capacity - self.available()
+            if len(samples) > free:
+                self.overruns += 1
+                self.dropped_frames += len(samples) - free
+                samples = samples[:free]
+            self._store(samples)
+        self.data_ready.set()
+
+    def _store(self, samples):
+        start = self.write_index % self.capacity
+        first = min(len(samples), self.capacity - start)
+        self.buffer[start:start + first] = samples[:first]
+        self.buffer[:len(samples) - first] = samples[first:]
+        self.write_index += len(samples) # Publish only once the frames are in place
+
+    def view(self, offset, frames):
+        """Consumer side: bytes view of `frames` frames starting `offset` frames past the read position.
+
+        Zero-copy unless the range wraps around the end of the ring; the view is
+        valid until those frames are consumed (or until the next wrapping view).
+        """
+        start = (self.read_index + offset) % self.capacity
+        if start + frames <= self.capacity:
+            return memoryview(self.buffer[start:start + frames]).cast('B')
+        first = self.capacity - start
+        self.scratch[:first] = self.buffer[start:]
+        self.scratch[first:frames] = self.buffer[:frames - first]
+        return memoryview(self.scratch[:frames]).cast('B')
+
+    def consume(self, frames):
+        self.read_index += min(frames, self.available())
+
+    def wait_for(self, frames, timeout=None):
+        """Blocks until at least `frames` frames are available; returns False on timeout."""
+        if self.available() >= frames:
+            return True
+        self.data_ready.clear()
+        if self.available() >= frames: # The producer may have written between the check and the clear
+            return True
+        self.data_ready.wait(timeout)
+        return self.available() >= frames
+
+    def clear(self):
+        with self.lock:
+            self.read_index = self.write_index
+
+    def discard_before(self, index):
+        """Drops everything older than absolute frame `index`."""
+        with self.lock:
+            self.read_index = min(self.write_index, max(self.read_index, index))
+
+    def set_overwrite(self, enabled):
+        with self.lock:
+            self.overwrite = enabled
+
+# --- Full-Duplex Audio (shared output stream, barge-in) ---
+class AudioOutput:
+    """One persistent output stream shared by every reply.
+
+    Replies are queued as PCM chunks and pulled by the PortAudio callback, so a
+    reply can be cancelled mid-way without tearing down the stream (which the
+    global sd.play/sd.stop cannot do).
+    """
+
+    def __init__(self, sample_rate, sink):
+        self.sample_rate = sample_rate
+        self.sink = sink
+        self.stream = None
+        self.lock = threading.Lock()
+        self.chunks = collections.deque()
+        self.offset = 0
+        self.drained = threading.Event()
+        self.drained.set()
+        self.cancelled = False
+        self.started_at = None
+        self.stopped_at = None
+        self.levels = collections.deque(maxlen=max(1, round(BARGE_IN_ECHO_WINDOW_MS / 1000 / OUTPUT_BLOCK_SECONDS)))
+
+    def start(self):
+        self.stream = self.sink.open(self.sample_rate, int(self.sample_rate * OUTPUT_BLOCK_SECONDS), self._callback)
+        self.stream.start()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def begin(self):
+        """Starts a new reply."""
+        with self.lock:
+            self.chunks.clear()
+            self.offset = 0
+            self.cancelled = False
+            self.started_at = None
+            self.stopped_at = None
+
+    def play(self, audio):
+        """Queues int16 samples behind whatever is already playing; returns immediately."""
+        with self.lock:
+            if self.cancelled:
+                return
+            self.chunks.append(memoryview(audio).cast('B'))
+            self.drained.clear()
+
+    def cancel(self):
+        """Drops everything still queued; the next callback already plays silence. Safe from any thread."""
+        with self.lock:
+            self.chunks.clear()
+            self.offset = 0
+            self.cancelled = True
+
+    def playback_level(self):
+        """Loudest int16 RMS handed to the device over the last BARGE_IN_ECHO_WINDOW_MS."""
+        with self.lock:
+            return max(self.levels, default=0.0)
+
+    def wait(self):
+        """Blocks until the queued audio has been played or the reply was cancelled."""
+        self.drained.wait()
+        if not self.cancelled and self.stream is not None:
+            time.sleep(self.stream.latency) # The last buffer is still in the device when the queue drains
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status:
+            print(status, file=sys.stderr)
+        wanted = len(outdata)
+        filled = 0
+        # This buffer reaches the DAC after the stream's output latency.
+        dac_delay = time_info.outputBufferDacTime - time_info.currentTime if time_info.outputBufferDacTime else 0.0
+        with self.lock:
+            while self.chunks and filled < wanted:
+                chunk = self.chunks[0]
+                count = min(wanted - filled, len(chunk) - self.offset)
+                outdata[filled:filled + count] = chunk[self.offset:self.offset + count]
+                filled += count
+                self.offset += count
+                if self.offset == len(chunk):
+                    self.chunks.popleft()
+                    self.offset = 0
+            if filled and self.started_at is None:
+                self.started_at = time.perf_counter() + max(0.0, dac_delay)
+            if filled:
+                played = np.frombuffer(outdata, dtype=np.int16, count=filled // 2).astype(np.float32)
+                self.levels.append(float(np.sqrt(np.mean(played * played))))
+            else:
+                self.levels.append(0.0)
+            if filled < wanted:
+                outdata[filled:] = b'\x00' * (wanted - filled)
+                if self.cancelled and self.stopped_at is None:
+                    # Audio handed over earlier keeps playing until this buffer reaches the DAC.
+                    self.stopped_at = time.perf_counter() + max(0.0, dac_delay)
+            if not self.chunks:
+                self.drained.set()
+
+class BargeInDetector:
+    """Listens to the microphone while a reply is playing and cuts it off when the user speaks.
+
+    While armed, the capture ring runs in overwrite mode and nothing consumes
+    it, so the assistant does not transcribe its own voice. On barge-in
+    playback is cancelled; disarm() then keeps the audio from a short pre-roll
+    before the trigger onwards, where the next listen() picks it up.
+    """
+
+    def __init__(self, output, ring, sample_rate=VOSK_SAMPLE_RATE):
+        self.output = output
+        self.ring = ring
+        self.frame_length = int(sample_rate * 0.02) # 20 ms analysis frames
+        self.frame_seconds = self.frame_length / sample_rate
+        self.min_speech_frames = max(1, BARGE_IN_MIN_SPEECH_MS // 20)
+        self.preroll_frames = int(sample_rate * BARGE_IN_PREROLL_MS / 1000)
+        self.armed = False
+        self.triggered = False
+        self.trigger_index = 0
+        self.speech_frames = 0
+        self.onset = None
+
+    def arm(self):
+        self.ring.clear() # Anything captured before the reply is stale
+        self.ring.set_overwrite(True)
+        self.triggered = False
+        self.speech_frames = 0
+        self.onset = None
+        self.armed = BARGE_IN
+
+    def disarm(self):
+        self.armed = False
+        self.ring.set_overwrite(False)
+        if self.triggered:
+            self.ring.discard_before(self.trigger_index - self.preroll_frames)
+        else:
+            self.ring.clear()
+
+    def feed(self, samples, captured_at):
+        """Called from the capture callback with each block (already in the ring) while armed.
+
+        Speech has to be louder than both BARGE_IN_RMS_THRESHOLD and the reply
+        being played (times BARGE_IN_ECHO_RATIO): the microphone also hears the
+        speakers, and the assistant must not interrupt itself.
+        """
+        rms, _ = frame_features(samples, self.frame_length)
+        loud = rms > max(BARGE_IN_RMS_THRESHOLD, BARGE_IN_ECHO_RATIO * self.output.playback_level())
+        for index, is_loud in enumerate(loud):
+            if not is_loud:
+                self.speech_frames = 0
+                continue
+            if self.speech_frames == 0:
+                self.onset = captured_at - (len(loud) - index) * self.frame_seconds
+            self.speech_frames += 1
+            if self.speech_frames >= self.min_speech_frames:
+                self._trigger()
+                return
+
+    def _trigger(self):
+        self.armed = False
+        self.triggered = True
+        self.trigger_index = self.ring.write_index
+        self.ring.set_overwrite(False) # From here on the user's speech must not be overwritten
+        self.output.cancel()
+
+    def latency(self):
+        """Seconds from speech onset to the end of playback for the last barge-in, if known."""
+        if not self.triggered or self.onset is None or self.output.stopped_at is None:
+            return None
+        return self.output.stopped_at - self.onset
+
+# --- Audio Sources and Sinks (live devices or headless replay) ---
+# run_assistant() takes a source, which delivers capture blocks to audio_callback, and a sink,
+# which opens the stream that pulls reply audio from AudioOutput. Headless ones need no sound card.
+class MicrophoneSource:
+    """Live capture from INPUT_DEVICE."""
+
+    def open(self, callback):
+        if sd is None:
+            raise RuntimeError("sounddevice/PortAudio is not available; use a headless source.")
+        return sd.RawInputStream(samplerate=VOSK_SAMPLE_RATE, blocksize=CAPTURE_BLOCK_SIZE, device=INPUT_DEVICE,
+                                 dtype='int16', channels=1, latency='low', callback=callback)
+
+    def listening(self):
+        pass
+
+    def finished(self):
+        return False
+
+class WavReplaySource:
+    """Replays a scripted conversation as if it were spoken into the microphone, one WAV file per user turn.
+
+    Each file starts when the assistant starts listening and is followed by
+    REPLAY_TRAILING_SILENCE_SECONDS of silence so that it gets endpointed. It is
+    delivered in capture-sized blocks at `speed` times real time.
+    """
+
+    def __init__(self, paths, speed=1.0, block_size=CAPTURE_BLOCK_SIZE):
+        self.paths = list(paths)
+        self.speed = speed
+        self.block_size = block_size
+        self.turn_requested = threading.Event()
+        self.exhausted = False
+        self.running = False
+        self.audio_seconds = 0.0 # Speech replayed so far, without the added silence
+
+    def open(self, callback):
+        self.callback = callback
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True, name="replay")
+        self.thread.start()
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.turn_requested.set()
+        self.thread.join()
+
+    def listening(self):
+        """Called by listen(): the next scripted utterance may start."""
+        self.turn_requested.set()
+
+    def finished(self):
+        return self.exhausted
+
+    def _run(self):
+        silence = np.zeros(int(VOSK_SAMPLE_RATE * REPLAY_TRAILING_SILENCE_SECONDS), dtype=np.int16)
+        block_seconds = self.block_size / VOSK_SAMPLE_RATE / self.speed
+        for path in self.paths:
+            self.turn_requested.wait()
+            self.turn_requested.clear()
+            speech = np.concatenate(list(iter_audio_chunks(path)) or [np.zeros(0, dtype=np.int16)])
+            self.audio_seconds += speech.size / VOSK_SAMPLE_RATE
+            samples = np.concatenate((speech, silence))
+            deadline = time.perf_counter()
+            for start in range(0, samples.size, self.block_size):
+                if not self.running:
+                    return
+                self.callback(samples[start:start + self.block_size], self.block_size, None, None)
+                deadline += block_seconds
+                time.sleep(max(0.0, deadline - time.perf_counter()))
+        self.turn_requested.wait() # The assistant is listening again after the last reply
+        self.exhausted = True
+
+class SoundCardSink:
+    """Plays replies on OUTPUT_DEVICE."""
+
+    def negotiate_rate(self, voice_rate):
+        """Returns the first rate the device accepts, trying the voice's own rate before OUTPUT_SAMPLE_RATES."""
+        if sd is None:
+            raise RuntimeError("sounddevice/PortAudio is not available; use a headless sink.")
+        error = None
+        for rate in dict.fromkeys((voice_rate,) + OUTPUT_SAMPLE_RATES):
+            try:
+                sd.check_output_settings(device=OUTPUT_DEVICE, samplerate=rate, channels=1, dtype='int16')
+                return rate
+            except Exception as e:
+                error = e
+        print(f"Warning: Audio output device check failed: {error}. Playback might have issues.")
+        return voice_rate
+
+    def open(self, sample_rate, blocksize, callback):
+        return sd.RawOutputStream(samplerate=sample_rate, blocksize=blocksize, device=OUTPUT_DEVICE, dtype='int16',
+                                  channels=1, latency='low', callback=callback)
+
+class NullSink:
+    """Discards replies, but pulls them at `speed` times real time like a sound card would, so
+    playback takes (scaled) real time. `sample_rate` forces a device rate, e.g. to exercise resampling."""
+
+    def __init__(self, speed=1.0, sample_rate=None):
+        self.speed = speed
+        self.sample_rate = sample_rate
+
+    def negotiate_rate(self, voice_rate):
+        return self.sample_rate or voice_rate
+
+    def open(self, sample_rate, blocksize, callback):
+        return ClockedOutputStream(self, sample_rate, blocksize, callback)
+
+    def write(self, block):
+        pass
+
+    def close(self):
+        pass
+
+class WavFileSink(NullSink):
+    """Records everything that would have been played, silence included, to a WAV file."""
+
+    def __init__(self, path, speed=1.0, sample_rate=None):
+        super().__init__(speed, sample_rate)
+        self.path = path
+        self.wav_file = None
+
+    def open(self, sample_rate, blocksize, callback):
+        self.wav_file = wave.open(self.path, 'wb')
+        self.wav_file.setnchannels(1)
+        self.wav_file.setsampwidth(2)
+        self.wav_file.setframerate(sample_rate)
+        return super().open(sample_rate, blocksize, callback)
+
+    def write(self, block):
+        self.wav_file.writeframes(block)
+
+    def close(self):
+        if self.wav_file is not None:
+            self.wav_file.close()
+            self.wav_file = None
+
+class ClockedOutputStream:
+    """Stands in for sd.RawOutputStream: a thread calls the output callback once per block and hands
+    the result to a headless sink."""
+
+    NO_DAC_TIME = types.SimpleNamespace(outputBufferDacTime=0.0, currentTime=0.0)
+
+    def __init__(self, sink, sample_rate, blocksize, callback):
+        self.sink = sink
+        self.blocksize = blocksize
+        self.callback = callback
+        self.latency = blocksize / sample_rate / sink.speed
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True, name="headless-output")
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.sink.close()
+
+    def _run(self):
+        block = bytearray(self.blocksize * 2)
+        deadline = time.perf_counter()
+        while self.running:
+            self.callback(block, self.blocksize, self.NO_DAC_TIME, None)
+            self.sink.write(block)
+            deadline += self.latency
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+
+# --- Intent Matching (declarative table compiled into one automaton) ---
+FRENCH_MONTHS = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août", "septembre", "octobre", "novembre", "décembre"]
+FRENCH_WEEKDAYS = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
+
+Intent = collections.namedtuple("Intent", "name priority order any_of all_of equals response exit slots")
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: finds every keyword occurring in a text in a single pass."""
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+        for index, keyword in enumerate(keywords):
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                state = next_state
+            self.outputs[state] += (index,)
+        # Breadth-first, so each failure link points at an already finished shallower state.
+        pending = collections.deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self.goto[state].items():
+                pending.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.outputs[next_state] += self.outputs[self.fail[next_state]]
+
+    def find(self, text):
+        """Returns the set of keyword indices occurring anywhere in text (overlaps included)."""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        state = 0
+        found = set()
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+def load_intent_table(path):
+    """Reads and sanity-checks the intent table (see intents_fr.json).
+
+    Each intent matches when the command contains one of its "any" keywords,
+    one keyword of every "all" group, and equals one of its "equals" phrases;
+    omitted conditions always hold. The matching intent with the lowest
+    "priority" wins. A null "response" answers with the table's fallback, and
+    "exit": true ends the session. "slots" fill {placeholders} from the first
+    keyword found, "" being the default.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        table = json.load(f)
+    for key in ("fallback", "empty", "intents"):
+        if key not in table:
+            raise ValueError(f"missing '{key}'")
+    for entry in table["intents"]:
+        if "name" not in entry:
+            raise ValueError(f"intent without a name: {entry}")
+        if not entry.get("exit") and "response" not in entry:
+            raise ValueError(f"intent '{entry['name']}' has neither a response nor exit")
+    return table
+
+class IntentMatcher:
+    """Routes a command through the intent table with one automaton scan.
+
+    Only intents sharing a keyword (or an exact phrase) with the command are
+    evaluated, so the cost depends on what was said, not on the table size.
+    """
+
+    def __init__(self, table):
+        self.fallback = table["fallback"]
+        self.empty = table["empty"]
+        keyword_ids = {}
+        keyword_id = lambda keyword: keyword_ids.setdefault(keyword, len(keyword_ids))
+        self.intents = []
+        self.by_keyword = collections.defaultdict(list)
+        self.by_command = collections.defaultdict(list)
+        self.unconditional = []
+        # Stable sort: equal priorities keep their order in the table.
+        for order, entry in enumerate(sorted(table["intents"], key=lambda entry: entry.get("priority", 0))):
+            slots = tuple((name, tuple((keyword_id(keyword) if keyword else None, value) for keyword, value in choices))
+                          for name, choices in entry.get("slots", {}).items())
+            intent = Intent(entry["name"], entry.get("priority", 0), order,
+                            frozenset(keyword_id(keyword) for keyword in entry.get("any", [])),
+                            tuple(frozenset(keyword_id(keyword) for keyword in group) for group in entry.get("all", [])),
+                            frozenset(entry.get("equals", [])), entry.get("response"), entry.get("exit", False), slots)
+            self.intents.append(intent)
+            if intent.equals:
+                for phrase in intent.equals:
+                    self.by_command[phrase].append(order)
+            elif intent.any_of:
+                for keyword in intent.any_of:
+                    self.by_keyword[keyword].append(order)
+            else:
+                self.unconditional.append(order)
+        self.keywords = list(keyword_ids)
+        self.automaton = KeywordAutomaton(self.keywords)
+
+    def match(self, command):
+        """Returns (Intent or None, set of keyword ids found in command)."""
+        hits = self.automaton.find(command)
+        candidates = set(self.unconditional)
+        candidates.update(self.by_command.get(command, ()))
+        for keyword in hits:
+            candidates.update(self.by_keyword.get(keyword, ()))
+        for order in sorted(candidates):
+            intent = self.intents[order]
+            if intent.equals and command not in intent.equals:
+                continue
+            if intent.any_of and not intent.any_of & hits:
+                continue
+            if all(group & hits for group in intent.all_of):
+                return intent, hits
+        return None, hits
+
+    def render(self, intent, hits, now=None):
+        now = now or datetime.datetime.now()
+        values = {"assistant_name": ASSISTANT_NAME, "hour": now.hour, "minute": now.minute, "day": now.day,
+                  "weekday": FRENCH_WEEKDAYS[now.weekday()], "month": FRENCH_MONTHS[now.month - 1], "year": now.year}
+        for name, choices in intent.slots:
+            values[name] = next((value for keyword, value in choices if keyword is None or keyword in hits), "")
+        return intent.response.format(**values)
+
+    def static_responses(self):
+        """Every response that renders the same way each time, slot variants included."""
+        responses = []
+        for intent in self.intents:
+            if intent.response is None:
+                continue
+            fields = {field for _, field, _, _ in string.Formatter().parse(intent.response) if field}
+            slot_names = [name for name, _ in intent.slots]
+            if not fields <= {"assistant_name", *slot_names}:
+                continue # Time, date, ...
+            for combination in itertools.product(*(choices for _, choices in intent.slots)):
+                values = {"assistant_name": ASSISTANT_NAME}
+                values.update((name, value) for name, (_, value) in zip(slot_names, combination))
+                responses.append(intent.response.format(**values))
+        return responses
+
+# --- Grammar-Constrained Recognition ---
+def grammar_phrases(matcher):
+    """Vosk phrase list for the closed domain: every intent keyword and exact phrase, plus "[unk]" for the rest."""
+    phrases = list(matcher.keywords)
+    for intent in matcher.intents:
+        phrases.extend(sorted(intent.equals))
+    return list(dict.fromkeys(phrases)) + ["[unk]"]
+
+class GrammarFallbackRecognizer:
+    """Drop-in KaldiRecognizer replacement that decodes against the intent vocabulary first.
+
+    The constrained recognizer is faster and more accurate on our keywords.
+    When its result is empty or its mean word confidence is below
+    GRAMMAR_MIN_CONFIDENCE, the buffered utterance is decoded again by an
+    open-vocabulary recognizer and that result is returned instead.
+    """
+
+    def __init__(self, model, sample_rate, phrases, min_confidence=GRAMMAR_MIN_CONFIDENCE):
+        import vosk
+        self.constrained = vosk.KaldiRecognizer(model, sample_rate, json.dumps(phrases, ensure_ascii=False))
+        self.constrained.SetWords(True) # Word confidences drive the fallback
+        self.open = vosk.KaldiRecognizer(model, sample_rate)
+        self.min_confidence = min_confidence
+        self.utterance = bytearray()
+        self.utterances = 0
+        self.fallbacks = 0
+
+    def SetWords(self, enabled):
+        self.open.SetWords(enabled)
+
+    def AcceptWaveform(self, data):
+        self.utterance += waveform_buffer(data)
+        return self.constrained.AcceptWaveform(data)
+
+    def PartialResult(self):
+        return self.constrained.PartialResult()
+
+    def Result(self):
+        return self._resolve(self.constrained.Result())
+
+    def FinalResult(self):
+        return self._resolve(self.constrained.FinalResult())
+
+    def Reset(self):
+        self.constrained.Reset()
+        self.open.Reset()
+        self.utterance.clear()
+
+    def _resolve(self, result_json):
+        result = json.loads(result_json)
+        audio = bytes(self.utterance)
+        self.utterance.clear()
+        words = [word for word in result.get("result", []) if word.get("word") != "[unk]"]
+        if not audio and not words:
+            return json.dumps({"text": ""})
+        self.utterances += 1
+        confidence = sum(word.get("conf", 0.0) for word in words) / len(words) if words else 0.0
+        if words and confidence >= self.min_confidence:
+            return json.dumps({"text": " ".join(word["word"] for word in words), "confidence": round(confidence, 3)},
+                              ensure_ascii=False)
+        self.fallbacks += 1
+        texts = []
+        if self.open.AcceptWaveform(audio):
+            texts.append(json.loads(self.open.Result()).get("text", ""))
+        texts.append(json.loads(self.open.FinalResult()).get("text", ""))
+        return json.dumps({"text": " ".join(text for text in texts if text), "fallback": True}, ensure_ascii=False)
+
+def create_recognizer(model, use_grammar=None):
+    """Recognizer for commands: open vocabulary, or grammar-first when STT_GRAMMAR is set."""
+    if use_grammar is None:
+        use_grammar = STT_GRAMMAR
+    if use_grammar:
+        return GrammarFallbackRecognizer(model, VOSK_SAMPLE_RATE, grammar_phrases(intent_matcher))
+    import vosk
+    recognizer = vosk.KaldiRecognizer(model, VOSK_SAMPLE_RATE)
+    recognizer.SetWords(False)
+    return recognizer
+
+# --- Speech Front End (VAD and endpointing) ---
+def frame_features(samples, frame_length):
+    """Per-frame RMS and zero-crossing rate of int16 samples, computed without a Python loop."""
+    usable = samples.size - samples.size % frame_length
+    frames = samples[:usable].reshape(-1, frame_length).astype(np.float32)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_length
+    return rms, zcr
+
+class EnergyVAD:
+    """Energy and zero-crossing voice activity detector over 20 ms frames.
+
+    A frame is speech when it is clearly above the tracked noise floor and not
+    hiss-like (too many zero crossings). The noise floor follows the quiet frames.
+    """
+
+    def __init__(self, sample_rate=VOSK_SAMPLE_RATE):
+        self.frame_length = int(sample_rate * 0.02)
+        self.noise_floor = VAD_MIN_RMS / VAD_NOISE_RATIO
+
+    def is_speech(self, block):
+        rms, zcr = frame_features(np.frombuffer(block, dtype=np.int16), self.frame_length)
+        speech = (rms > max(VAD_MIN_RMS, self.noise_floor * VAD_NOISE_RATIO)) & (zcr < VAD_MAX_ZCR)
+        quiet = rms[~speech]
+        if quiet.size:
+            self.noise_floor = 0.9 * self.noise_floor + 0.1 * float(np.median(quiet))
+        return np.count_nonzero(speech) >= VAD_MIN_SPEECH_FRAMES
+
+class SpeechFrontEnd:
+    """Feeds the capture ring to a recognizer in BLOCK_SIZE steps.
+
+    With the VAD on, silence is not decoded at all: the last few silent blocks
+    are simply left unconsumed in the ring as pre-roll, and decoded once speech
+    starts. After ENDPOINT_SILENCE_MS of trailing silence the utterance is
+    finalized with FinalResult() instead of waiting for Kaldi's own endpointer.
+    """
+
+    def __init__(self, recognizer, use_vad=None, block_size=BLOCK_SIZE, endpoint_silence_ms=ENDPOINT_SILENCE_MS,
+                 sample_rate=VOSK_SAMPLE_RATE, metrics=None):
+        self.recognizer = recognizer
+        self.metrics = metrics # VoiceLoopMetrics for the live loop; None elsewhere
+        self.sample_rate = sample_rate
+        self.vad = EnergyVAD(sample_rate) if (VAD_ENABLED if use_vad is None else use_vad) else None
+        self.block_frames = block_size
+        self.block_seconds = block_size / sample_rate
+        self.preroll_frames = VAD_PREROLL_BLOCKS * block_size
+        self.endpoint_silence = endpoint_silence_ms / 1000
+        self.lag = 0 # Pre-roll frames left unconsumed behind the block being examined
+        self.in_speech = False
+        self.trailing_silence = 0.0
+        self.last_endpoint_latency = None
+
+    def reset(self):
+        self.recognizer.Reset()
+        self.lag = 0
+        self.in_speech = False
+        self.trailing_silence = 0.0
+
+    def poll(self, ring, timeout=0.1):
+        """Decodes the whole blocks waiting in `ring`; returns ("partial" | "final", text) for the last one, or None."""
+        event = None
+        if not ring.wait_for(self.lag + self.block_frames, timeout):
+            return None
+        while ring.available() >= self.lag + self.block_frames:
+            event = self._step(ring) or event
+            if event and event[0] == "final":
+                break # Leave the rest for the next utterance
+        return event
+
+    def _step(self, ring):
+        if self.vad is not None:
+            if self.vad.is_speech(ring.view(self.lag, self.block_frames)):
+                self.trailing_silence = 0.0
+                if not self.in_speech:
+                    self.in_speech = True
+                    if self.metrics is not None:
+                        # The block under examination started this long before the newest captured sample.
+                        self.metrics.mark("speech_start", time.perf_counter() - (ring.available() - self.lag) / self.sample_rate)
+                    while self.lag > 0: # Decode the pre-roll first
+                        frames = min(self.lag, self.block_frames)
+                        self.recognizer.AcceptWaveform(as_waveform(ring.view(0, frames)))
+                        ring.consume(frames)
+                        self.lag -= frames
+            elif self.in_speech:
+                self.trailing_silence += self.block_seconds
+            else:
+                # Nobody is talking: skip the decoder and keep only the pre-roll.
+                self.lag += self.block_frames
+                if self.lag > self.preroll_frames:
+                    ring.consume(self.lag - self.preroll_frames)
+                    self.lag = self.preroll_frames
+                return None
+        accepted = self.recognizer.AcceptWaveform(as_waveform(ring.view(0, self.block_frames)))
+        ring.consume(self.block_frames)
+        if accepted:
+            return self._final(self.recognizer.Result)
+        if self.vad is not None and self.trailing_silence >= self.endpoint_silence:
+            return self._final(self.recognizer.FinalResult)
+        return "partial", json.loads(self.recognizer.PartialResult()).get("partial", "")
+
+    def _final(self, finalize):
+        if self.metrics is not None:
+            self.metrics.mark("endpoint")
+        result_json = finalize()
+        if self.metrics is not None:
+            self.metrics.mark("final_text")
+        self.last_endpoint_latency = self.trailing_silence if self.vad is not None else None
+        self.in_speech = False
+        self.trailing_silence = 0.0
+        return "final", json.loads(result_json).get("text", "")
+
+# --- Stub Backends (benchmarks without models) ---
+class StubRecognizer:
+    """Stands in for vosk.KaldiRecognizer: returns the next scripted transcript for each utterance
+    that contained audible sound, and endpoints on its own after ENDPOINT_SILENCE_MS of quiet."""
+
+    def __init__(self, transcripts, sample_rate=VOSK_SAMPLE_RATE):
+        self.transcripts = collections.deque(transcripts)
+        self.endpoint_frames = int(sample_rate * ENDPOINT_SILENCE_MS / 1000)
+        self.heard = False
+        self.quiet_frames = 0
+
+    def SetWords(self, enabled):
+        pass
+
+    def AcceptWaveform(self, data):
+        samples = np.frombuffer(waveform_buffer(data), dtype=np.int16).astype(np.float32)
+        if samples.size and np.sqrt(np.mean(samples * samples)) > VAD_MIN_RMS:
+            self.heard = True
+            self.quiet_frames = 0
+        else:
+            self.quiet_frames += samples.size
+        return self.heard and self.quiet_frames >= self.endpoint_frames
+
+    def _take(self):
+        text = self.transcripts.popleft() if self.heard and self.transcripts else ""
+        self.heard = False
+        self.quiet_frames = 0
+        return json.dumps({"text": text})
+
+    def Result(self):
+        return self._take()
+
+    def FinalResult(self):
+        return self._take()
+
+    def PartialResult(self):
+        return json.dumps({"partial": "..." if self.heard else ""})
+
+    def Reset(self):
+        self.heard = False
+        self.quiet_frames = 0
+
+class StubPiperWorker:
+    """Stands in for PiperWorker: "synthesizes" a quiet tone lasting STUB_TTS_SECONDS_PER_CHAR per character."""
+
+    def __init__(self, worker_id, work_dir):
+        self.worker_id = worker_id
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+    def alive(self):
+        return self.running
+
+    def stop(self):
+        self.running = False
+
+    def synthesize(self, text):
+        frames = int(PIPER_SAMPLE_RATE * STUB_TTS_SECONDS_PER_CHAR * max(1, len(text)))
+        tone = 1000 * np.sin(2 * np.pi * 220 / PIPER_SAMPLE_RATE * np.arange(frames, dtype=np.float32))
+        return tone.astype(np.int16), PIPER_SAMPLE_RATE
+
+# --- Instrumentation (per-stage latency, metrics endpoint, sampling profiler) ---
+# Stages of one voice turn, in order. Each histogram measures the time from the previous stage that was reached.
+TURN_STAGES = ("speech_start", "endpoint", "final_text", "intent", "tts_first_byte", "playback_start", "playback_end")
+
+class LatencyHistogram:
+    """HDR-style histogram of durations: log-linear buckets with 128 sub-buckets per power of two.
+
+    Values are recorded in microseconds with under 1% relative error in fixed
+    memory, whatever the range (a microsecond to hours).
+    """
+
+    SUB_BITS = 7
+
+    def __init__(self):
+        self.counts = [0] * (64 << self.SUB_BITS)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def _index(self, micros):
+        exponent = micros.bit_length() - 1
+        if exponent <= self.SUB_BITS:
+            return micros
+        shift = exponent - self.SUB_BITS
+        return ((shift + 1) << self.SUB_BITS) + (micros >> shift) - (1 << self.SUB_BITS)
+
+    def _value(self, index):
+        block = index >> self.SUB_BITS
+        if block <= 1:
+            return index
+        shift = block - 1
+        mantissa = (index & ((1 << self.SUB_BITS) - 1)) + (1 << self.SUB_BITS)
+        return (mantissa << shift) + (1 << shift) // 2 # Middle of the bucket
+
+    def record(self, seconds):
+        self.counts[self._index(max(0, int(seconds * 1e6)))] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self._value(index) / 1e6, self.maximum)
+        return self.maximum
+
+class VoiceLoopMetrics:
+    """Collects monotonic timestamps for the stages of each turn and keeps a histogram per stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {stage: LatencyHistogram() for stage in TURN_STAGES[1:] + ("response", "turn")}
+        self.turn = {}
+        self.turns = 0
+        self.jsonl_path = None
+        self.turn_log = None # A list to append each finished turn to (stage -> seconds since its first stage)
+
+    def mark(self, stage, at=None):
+        """Records when `stage` was reached in the current turn (the first mark wins)."""
+        with self.lock:
+            self.turn.setdefault(stage, at if at is not None else time.perf_counter())
+
+    def discard_turn(self):
+        """Forgets the current turn, e.g. when the "speech" turned out to be noise."""
+        with self.lock:
+            self.turn = {}
+
+    def end_turn(self):
+        """Closes the current turn: feeds the histograms and appends the turn to the JSONL dump.
+
+        Replies nobody asked for (the greeting, error messages) have no final_text and are not counted.
+        """
+        with self.lock:
+            turn, self.turn = self.turn, {}
+            reached = [stage for stage in TURN_STAGES if stage in turn]
+            if "final_text" not in turn:
+                return
+            self.turns += 1
+            for previous, stage in zip(reached, reached[1:]):
+                self.histograms[stage].record(turn[stage] - turn[previous])
+            if "endpoint" in turn and "playback_start" in turn:
+                self.histograms["response"].record(turn["playback_start"] - turn["endpoint"]) # What the user waits for
+            self.histograms["turn"].record(turn[reached[-1]] - turn[reached[0]])
+        origin = turn[reached[0]]
+        if self.turn_log is not None:
+            self.turn_log.append({stage: turn[stage] - origin for stage in reached})
+        if self.jsonl_path:
+            record = {"type": "turn", "time": time.time(), **{stage: round(turn[stage] - origin, 6) for stage in reached}}
+            self._append(record)
+
+    def snapshot(self):
+        with self.lock:
+            return {stage: {"count": h.count, "p50": h.percentile(50), "p90": h.percentile(90), "p99": h.percentile(99),
+                            "max": h.maximum, "sum": h.total} for stage, h in self.histograms.items()}
+
+    def dump_snapshot(self):
+        self._append({"type": "snapshot", "time": time.time(), "turns": self.turns, "stages": self.snapshot()})
+
+    def _append(self, record):
+        with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+
+    def prometheus_text(self):
+        lines = ["# HELP assistant_stage_seconds Time to reach each stage of a voice turn from the previous stage.",
+                 "# TYPE assistant_stage_seconds summary"]
+        for stage, summary in self.snapshot().items():
+            for quantile, key in (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99")):
+                lines.append(f'assistant_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {summary[key]:.6f}')
+            lines.append(f'assistant_stage_seconds_sum{{stage="{stage}"}} {summary["sum"]:.6f}')
+            lines.append(f'assistant_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        lines += ["# TYPE assistant_turns_total counter", f"assistant_turns_total {self.turns}"]
+        if capture_ring is None: # Audio not started yet
+            return "\n".join(lines) + "\n"
+        lines += ["# TYPE assistant_capture_overruns_total counter", f"assistant_capture_overruns_total {capture_ring.overruns}",
+                  "# TYPE assistant_capture_dropped_seconds_total counter",
+                  f"assistant_capture_dropped_seconds_total {capture_ring.dropped_frames / VOSK_SAMPLE_RATE:.3f}",
+                  "# TYPE assistant_capture_backlog_seconds gauge", f"assistant_capture_backlog_seconds {capture_ring.backlog_seconds():.3f}"]
+        return "\n".join(lines) + "\n"
+
+def start_metrics_server(port, host=METRICS_HOST):
+    """Serves metrics.prometheus_text() at http://<host>:<port>/metrics from a daemon thread."""
+    import http.server
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Scrapes would interleave with the conversation on stdout
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    print(f"Metrics available at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+def start_metrics_dump(path, interval=METRICS_DUMP_SECONDS):
+    """Appends every finished turn, plus a histogram snapshot every `interval` seconds, to a JSONL file."""
+    metrics.jsonl_path = path
+    def dump_periodically():
+        while True:
+            time.sleep(interval)
+            metrics.dump_snapshot()
+    threading.Thread(target=dump_periodically, daemon=True, name="metrics-dump").start()
+    atexit.register(metrics.dump_snapshot)
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads at a fixed interval and writes them in folded form
+    (one "frame;frame;frame count" line per stack), ready for flamegraph tools."""
+
+    def __init__(self, output_path, interval=PROFILE_INTERVAL):
+        self.output_path = output_path
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True, name="profiler").start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while self.running:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        with open(self.output_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profile written to '{self.output_path}' ({sum(self.stacks.values())} samples).")
 
 # --- Initialization ---
-print("--- Initialization ---")
-try:
-    vosk.SetLogLevel(-1)
-    stt_model = vosk.Model(VOSK_MODEL_PATH)
-    stt_recognizer = vosk.KaldiRecognizer(stt_model, VOSK_SAMPLE_RATE)
-    stt_recognizer.SetWords(False)
-    print("Vosk STT initialized.")
-except Exception as e:
-    print(f"Error initializing Vosk STT: {e}")
-    traceback.print_exc()
-    sys.exit(1)
+# Nothing is loaded at import time: batch workers (spawned processes), the STT load-test client and the
+# intent tools import this module without touching the models. The main block loads what its mode needs.
+metrics = VoiceLoopMetrics()
+intent_matcher = None
+stt_model = stt_recognizer = stt_front_end = None
+tts_cache = tts_engine = None
+capture_ring = audio_output = barge_in = None
+audio_source = None # Set by run_assistant()
+startup_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+startup_tasks = {} # name -> Future of an init function running on startup_pool
+
+def load_intents():
+    global intent_matcher, STATIC_RESPONSES
+    try:
+        intent_matcher = IntentMatcher(load_intent_table(INTENTS_PATH))
+        print(f"Intent table compiled ({len(intent_matcher.intents)} intents, {len(intent_matcher.keywords)} keywords).")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading intent table '{INTENTS_PATH}': {e}")
+        sys.exit(1)
+    STATIC_RESPONSES = frozenset(static_responses())
+
+def load_stt(stub=False):
+    global stt_model, stt_recognizer, stt_front_end
+    if stub:
+        stt_recognizer = StubRecognizer([])
+        stt_front_end = SpeechFrontEnd(stt_recognizer, metrics=metrics)
+        print("Stub STT in use (scripted transcripts, no model).")
+        return
+    try:
+        start = time.perf_counter()
+        import vosk # Pulls in requests and tqdm (~0.1 s), so it is imported here, on the loader thread
+        vosk.SetLogLevel(-1)
+        stt_model = vosk.Model(VOSK_MODEL_PATH)
+        stt_recognizer = create_recognizer(stt_model)
+        stt_front_end = SpeechFrontEnd(stt_recognizer, metrics=metrics)
+        print(f"Vosk STT initialized ({time.perf_counter() - start:.1f}s).")
+    except Exception as e:
+        print(f"Error initializing Vosk STT: {e}")
+        traceback.print_exc()
+        sys.exit(1)
+
+def start_tts(stub=False):
+    global tts_cache, tts_engine
+    try:
+        start = time.perf_counter()
+        if stub: # No cache either: its keys would not tell stub audio from the real voice
+            tts_engine = TTSEngine(PIPER_WORKERS, worker_class=StubPiperWorker)
+        else:
+            tts_cache = AudioCache(TTS_CACHE_DIR, PIPER_VOICE_MODEL, PIPER_VOICE_JSON)
+            tts_engine = TTSEngine(PIPER_WORKERS, cache=tts_cache)
+        atexit.register(tts_engine.close)
+        tts_engine.start()
+        print(f"Piper TTS engine started ({len(tts_engine.workers)} warm worker(s), {time.perf_counter() - start:.1f}s).")
+    except Exception as e:
+        print(f"Error starting Piper TTS engine: {e}")
+        traceback.print_exc()
+        sys.exit(1)
+
+def init_audio(sink):
+    global capture_ring, audio_output, barge_in
+    voice_rate = tts_cache.sample_rate if tts_cache is not None else PIPER_SAMPLE_RATE
+    output_rate = sink.negotiate_rate(voice_rate)
+    if output_rate == voice_rate:
+        print(f"Audio output device check successful ({output_rate} Hz).")
+    else:
+        print(f"Audio output device runs at {output_rate} Hz; replies are resampled from {voice_rate} Hz.")
+    tts_engine.output_rate = output_rate
+    capture_ring = AudioRingBuffer(CAPTURE_RING_SECONDS * VOSK_SAMPLE_RATE)
+    audio_output = AudioOutput(output_rate, sink)
+    barge_in = BargeInDetector(audio_output, capture_ring)
+
+def start_in_background(name, init):
+    """Runs one of the init functions above on a startup thread; wait_until_ready(name) joins it."""
+    startup_tasks[name] = startup_pool.submit(init)
 
-audio_queue = queue.Queue()
+def wait_until_ready(name):
+    """Blocks until a background init has finished. If it failed it has already printed why and its
+    sys.exit() is re-raised here, on the main thread."""
+    task = startup_tasks.get(name)
+    if task is not None:
+        task.result()
 
 # --- TTS Function (speak) ---
-# (This function remains the same)
+def split_for_speech(text):
+    """Splits a response into numbered steps and sentences so each can be played as soon as it is ready."""
+    segments = []
+    for line in text.splitlines():
+        # Split after sentence punctuation, but not after a step number such as "1."
+        for sentence in re.split(r'(?<=[.!?])(?<!\d\.)\s+', line.strip()):
+            if sentence:
+                segments.append(sentence)
+    return segments
+
 def speak(text):
+    """Plays a reply; returns True if the user interrupted it (their speech is then queued for listen())."""
     print(f"{ASSISTANT_NAME}: {text}")
-    if not os.path.exists(PIPER_EXE_PATH):
-        print(f"Error: Piper executable not found at '{os.path.abspath(PIPER_EXE_PATH)}'.")
-        return
-    if not os.path.exists(PIPER_VOICE_MODEL):
-        print(f"Error: Piper voice model not found at '{os.path.abspath(PIPER_VOICE_MODEL)}'.")
-        return
+    segments = split_for_speech(text)
+    if not segments:
+        return False
+    start = time.perf_counter()
+    first_audio = None
+    barge_in.arm()
+    audio_output.begin()
+    synthesis = tts_engine.synthesize_stream(segments, store=text in STATIC_RESPONSES)
     try:
-        command = [PIPER_EXE_PATH, '--model', PIPER_VOICE_MODEL, '--output_raw']
-        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_data, stderr_data = process.communicate(input=text.encode('utf-8'))
-        stderr_output = stderr_data.decode('utf-8', errors='ignore')
-        if process.returncode != 0:
-            print(f"Piper Error Code: {process.returncode}\nPiper stderr:\n{stderr_output}")
-            return
-        if not stdout_data:
-            print("Piper produced no audio output.")
-            return
-        audio_data = np.frombuffer(stdout_data, dtype=np.int16)
-        if audio_data.size == 0:
-             print("Warning: Received empty audio data from Piper.")
-             return
-        sd.play(audio_data, samplerate=PIPER_SAMPLE_RATE, device=OUTPUT_DEVICE)
-        sd.wait()
+        for audio_data, sample_rate in synthesis:
+            if audio_output.cancelled:
+                break
+            if audio_data.size == 0:
+                continue
+            if first_audio is None:
+                metrics.mark("tts_first_byte")
+                first_audio = time.perf_counter() - start
+            # Playback of this segment overlaps with synthesis of the next ones.
+            audio_output.play(audio_data)
+        if first_audio is None and not audio_output.cancelled:
+            print("Warning: Received empty audio data from Piper.")
+            return False
+        audio_output.wait() # Returns early on barge-in
     except Exception as e:
         print(f"Error during TTS processing or playback: {e}")
         traceback.print_exc()
+    finally:
+        synthesis.close()
+        barge_in.disarm()
+        if audio_output.started_at is not None:
+            metrics.mark("playback_start", audio_output.started_at)
+        metrics.mark("playback_end", audio_output.stopped_at if barge_in.triggered and audio_output.stopped_at else None)
+        metrics.end_turn()
+        if barge_in.triggered and barge_in.onset is not None:
+            metrics.mark("speech_start", barge_in.onset) # The interruption opens the next turn
+    if barge_in.triggered:
+        latency = barge_in.latency()
+        print(f"(Barge-in: playback stopped {latency * 1000:.0f} ms after speech onset)" if latency is not None else "(Barge-in)")
+        return True
+    if first_audio is not None:
+        print(f"(TTS: first audio after {first_audio * 1000:.0f} ms, total {(time.perf_counter() - start) * 1000:.0f} ms, {len(segments)} segment(s))")
+    return False
 
 
 # --- Audio Callback (audio_callback) ---
-# (This function remains the same)
-def audio_callback(indata, frames, time, status):
+def audio_callback(indata, frames, time_info, status):
     if status:
         print(status, file=sys.stderr)
-    audio_queue.put(bytes(indata))
+    samples = np.frombuffer(indata, dtype=np.int16) # A view on PortAudio's buffer, copied once into the ring
+    capture_ring.write(samples)
+    if barge_in.armed:
+        barge_in.feed(samples, time.perf_counter())
 
 # --- STT Function (listen) ---
-# (This function remains the same)
 def listen():
+    """Decodes queued microphone audio until an utterance is recognized.
+
+    The capture stream stays open for the whole session (see the main loop),
+    so speech that interrupted the previous reply is already waiting here.
+    On the first call the Vosk model may still be loading in the background.
+    """
+    wait_until_ready("stt")
+    audio_source.listening()
     print("\nListening...")
-    with audio_queue.mutex:
-        audio_queue.queue.clear()
+    overruns = capture_ring.overruns
     try:
-        with sd.RawInputStream(samplerate=VOSK_SAMPLE_RATE, blocksize=BLOCK_SIZE, device=INPUT_DEVICE,
-                               dtype='int16', channels=1, callback=audio_callback):
-            while True:
-                data = audio_queue.get()
-                if data:
-                    if stt_recognizer.AcceptWaveform(data):
-                        result_json = stt_recognizer.Result()
-                        result_dict = json.loads(result_json)
-                        text = result_dict.get("text", "")
-                        if text:
-                            sys.stdout.write(" " * 60 + "\r")
-                            sys.stdout.flush()
-                            print(f"You: {text}")
-                            return text.lower().strip()
-                    else:
-                        partial_result_json = stt_recognizer.PartialResult()
-                        partial_result_dict = json.loads(partial_result_json)
-                        partial_text = partial_result_dict.get("partial", "")
-                        if partial_text:
-                            sys.stdout.write(f"Partial: {partial_text}    \r")
-                            sys.stdout.flush()
+        while True:
+            event = stt_front_end.poll(capture_ring)
+            if capture_ring.overruns != overruns:
+                overruns = capture_ring.overruns
+                print(f"\nWarning: decoder is falling behind ({capture_ring.dropped_frames / VOSK_SAMPLE_RATE:.1f}s of audio dropped, "
+                      f"backlog {capture_ring.backlog_seconds():.1f}s).")
+            if event is None:
+                if audio_source.finished(): # Scripted input is over and nothing is left to decode
+                    return "__end_of_input__"
+                continue
+            kind, text = event
+            if kind == "final" and not text:
+                metrics.discard_turn()
+            if kind == "final" and text:
+                sys.stdout.write(" " * 60 + "\r")
+                sys.stdout.flush()
+                print(f"You: {text}")
+                if stt_front_end.last_endpoint_latency is not None:
+                    print(f"(Endpoint: {stt_front_end.last_endpoint_latency * 1000:.0f} ms of trailing silence)")
+                return text.lower().strip()
+            if kind == "partial" and text:
+                metrics.mark("speech_start") # Without the VAD the first partial is the earliest sign of speech
+                sys.stdout.write(f"Partial: {text}    \r")
+                sys.stdout.flush()
     except KeyboardInterrupt:
         sys.stdout.write(" " * 60 + "\r")
         sys.stdout.flush()
         print("\nStopped listening.")
-        stt_recognizer.Reset()
+        stt_front_end.reset()
         return "__keyboard_interrupt__"
     except Exception as e:
         sys.stdout.write(" " * 60 + "\r")
         sys.stdout.flush()
         print(f"Error during listening: {e}")
         traceback.print_exc()
-        stt_recognizer.Reset()
+        stt_front_end.reset()
         return None
 
-# --- ############################################## ---
-# --- Command Processing - MODIFIED FOR IT SUPPORT ---
-# --- ############################################## ---
+# --- Command Processing ---
+def route_command(command):
+    """Picks the intent for a recognized command and generates its IT support response.
+
+    Routing is driven by the intent table (INTENTS_PATH). Returns
+    (intent, response); the response is None for the exit intent.
+    """
+    if command == "__keyboard_interrupt__":
+        return "goodbye", "Au revoir !"
+    if not command:
+        return "empty", intent_matcher.empty
+
+    intent, hits = intent_matcher.match(command.strip())
+    if intent is None or (intent.response is None and not intent.exit):
+        return "fallback", intent_matcher.fallback.format(command=command)
+    if intent.exit:
+        return intent.name, None # Signal to exit the main loop
+    return intent.name, intent_matcher.render(intent, hits)
+
 def process_command(command):
     """Processes the recognized command and generates an IT support response."""
-    if command == "__keyboard_interrupt__":
-        return "Au revoir !"
+    return route_command(command)[1]
 
-    response = f"Désolé, je ne suis pas sûr de comprendre le problème '{command}'. Pouvez-vous reformuler ?" # Default response
-    if not command:
-        return "Je n'ai rien entendu. Veuillez répéter votre problème."
-
-    command = command.strip()
-
-    # --- General Commands ---
-    if "bonjour" in command or "salut" in command:
-        response = "Bonjour ! Décrivez-moi votre problème technique."
-    elif "quelle heure" in command or "l'heure" in command:
-        now = datetime.datetime.now()
-        response = f"Il est {now.hour} heures {now.minute}." # Keep some basic functions
-    elif "quelle date" in command or "la date" in command:
-        now = datetime.datetime.now()
-        mois = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août", "septembre", "octobre", "novembre", "décembre"]
-        jour = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
-        response = f"Nous sommes le {jour[now.weekday()]} {now.day} {mois[now.month - 1]} {now.year}."
-    elif "qui es tu" in command or "comment tu t'appelles" in command:
-         response = f"Je suis {ASSISTANT_NAME}, votre assistant de support technique local."
-    elif command in ["merci", "c'est bon", "résolu", "ça marche"]:
-         response = "Parfait ! N'hésitez pas si vous avez un autre problème."
-         # Optionally return None here too if "merci" should end interaction
-    elif command in ["arrête", "au revoir", "quitter", "stop"]:
-        response = "Support terminé. Au revoir !"
-        return None # Signal to exit the main loop
-
-    # --- IT Support Keywords ---
-
-    # == Printer Issues ==
-    elif "imprimante" in command or "imprime pas" in command or "impression" in command:
-        if "bloqué" in command or "erreur" in command or "marche pas" in command or "fonctionne pas" in command:
-             response = ("Problème d'imprimante détecté. Voici quelques étapes :\n"
-                        "1. Vérifiez que l'imprimante est allumée et bien branchée (USB et alimentation).\n"
-                        "2. Assurez-vous qu'il y a du papier et de l'encre ou du toner.\n"
-                        "3. Essayez de redémarrer l'imprimante et votre ordinateur.\n"
-                        "4. Ouvrez la file d'attente d'impression sur votre PC et annulez les travaux bloqués.\n"
-                        "5. Essayez d'imprimer une page de test depuis les paramètres Windows de l'imprimante.")
-        else:
-             response = "Vous avez un souci avec l'impression ? Pourriez-vous préciser ? Par exemple, l'imprimante ne répond pas, ou il y a une erreur ?"
-
-    # == Network / Internet Issues ==
-    elif "internet" in command or "wifi" in command or "wi-fi" in command or "connexion" in command or "réseau" in command:
-        if "marche pas" in command or "fonctionne pas" in command or "pas de connexion" in command or "aucun accès" in command:
-             response = ("Problème de connexion internet. Essayons ceci :\n"
-                        "1. Vérifiez si d'autres appareils (téléphone, autre PC) ont accès à internet. Cela permet de savoir si le problème vient de votre PC ou du réseau.\n"
-                        "2. Redémarrez votre modem et votre routeur. Débranchez-les pendant 30 secondes, puis rebranchez d'abord le modem, attendez qu'il soit stable, puis le routeur.\n"
-                        "3. Redémarrez votre ordinateur.\n"
-                        "4. Si vous êtes en Wifi, vérifiez que vous êtes connecté au bon réseau et que le signal est suffisant.\n"
-                        "5. Si vous êtes par câble, vérifiez que le câble est bien branché des deux côtés.\n"
-                        "Si le problème persiste après ces étapes, contactez votre fournisseur d'accès.")
-        elif "lent" in command or "lente" in command:
-             response = ("Connexion internet lente ? Voici quelques pistes :\n"
-                        "1. Redémarrez votre modem, routeur et ordinateur.\n"
-                        "2. Rapprochez-vous de votre routeur Wifi si possible.\n"
-                        "3. Vérifiez si des téléchargements lourds ou des mises à jour sont en cours sur votre PC ou d'autres appareils.\n"
-                        "4. Trop d'appareils connectés en même temps peuvent ralentir la connexion.")
-        else:
-             response = "Vous avez un problème de réseau ou d'internet ? Est-ce une absence de connexion, ou une lenteur ?"
-
-    # == Computer Performance Issues ==
-    elif ("ordinateur" in command or "pc" in command or "système" in command) and \
-         ("lent" in command or "rame" in command or "bloqué" in command or "figé" in command):
-        response = ("Ordinateur lent ou bloqué ? Essayons ces actions :\n"
-                   "1. La première chose à faire : redémarrez complètement l'ordinateur.\n"
-                   "2. Fermez toutes les applications que vous n'utilisez pas activement.\n"
-                   "3. Vérifiez si votre disque dur n'est pas presque plein.\n"
-                   "4. Assurez-vous que Windows et vos pilotes sont à jour.\n"
-                   "5. Vous pouvez ouvrir le Gestionnaire des tâches (Ctrl + Maj + Echap) pour voir si un programme utilise anormalement beaucoup de ressources, mais je ne peux pas le faire pour vous.\n"
-                   "6. Pensez à faire une analyse antivirus et anti-malware.")
-
-    # == Software / Bureautique Issues ==
-    elif "word" in command or "excel" in command or "outlook" in command or "powerpoint" in command or "office" in command:
-         if "ouvre pas" in command or "ne répond pas" in command or "bloqué" in command or "erreur" in command:
-              app_name = "Word" if "word" in command else "Excel" if "excel" in command else "Outlook" if "outlook" in command else "PowerPoint" if "powerpoint" in command else "une application Office"
-              response = (f"Problème avec {app_name}. Voici des suggestions :\n"
-                         f"1. Essayez de fermer complètement {app_name} (via le Gestionnaire des tâches si nécessaire) et de le rouvrir.\n"
-                         "2. Redémarrez votre ordinateur.\n"
-                         "3. Le problème se produit-il avec un seul fichier ou tous les fichiers de ce type ? Si c'est un seul fichier, il est peut-être corrompu.\n"
-                         f"4. Essayez de lancer {app_name} en mode sans échec. Pour cela, cherchez '{app_name} /safe' dans la barre de recherche Windows.\n"
-                         "5. Vous pouvez tenter de réparer l'installation d'Office depuis le Panneau de configuration, sous 'Programmes et fonctionnalités'.")
-         else:
-              response = "Vous rencontrez un souci avec une application Office ? Laquelle et que se passe-t-il exactement ?"
-
-    # == Portability / Laptop specific (basic) ==
-    elif "portable" in command or "batterie" in command:
-        if "charge pas" in command:
-             response = ("Problème de charge de la batterie du portable ?\n"
-                        "1. Vérifiez que le chargeur est bien branché à la prise murale et au portable.\n"
-                        "2. Essayez une autre prise murale si possible.\n"
-                        "3. Vérifiez l'état du câble et du connecteur du chargeur (pas de dommage visible).\n"
-                        "4. Redémarrez l'ordinateur portable.\n"
-                        "5. Si possible, retirez la batterie (si elle est amovible), nettoyez les contacts, et remettez-la.")
-        elif "tient pas" in command or "vide vite" in command:
-             response = ("La batterie de votre portable se décharge vite ?\n"
-                        "1. Réduisez la luminosité de l'écran.\n"
-                        "2. Fermez les programmes gourmands en ressources que vous n'utilisez pas.\n"
-                        "3. Déconnectez les périphériques USB non nécessaires.\n"
-                        "4. Vérifiez les paramètres d'alimentation de Windows pour optimiser l'autonomie.\n"
-                        "Il est normal que les batteries perdent de leur capacité avec le temps.")
-
-    # == Password Issues (General Advice Only) ==
-    elif "mot de passe" in command or "compte" in command:
-         if "oublié" in command:
-              response = ("Mot de passe oublié ? Malheureusement, je ne peux pas le récupérer pour vous. \n"
-                         "Utilisez l'option 'Mot de passe oublié' ou 'Réinitialiser le mot de passe' sur le site web ou l'application concernée. \n"
-                         "Vérifiez aussi que la touche Verr Maj (Caps Lock) n'est pas activée.")
-         elif "bloqué" in command:
-              response = ("Compte bloqué ? Cela arrive souvent après trop de tentatives de connexion échouées.\n"
-                         "Attendez un peu (parfois 30 minutes ou une heure) avant de réessayer.\n"
-                         "Sinon, utilisez l'option 'Mot de passe oublié' ou contactez le support du service concerné.")
-
-    # --- Default fallback if specific IT keywords not matched ---
-    # (The default response defined at the beginning of the function will be used)
-
-    return response
+# --- Canned Responses ---
+GREETING_RESPONSE = f"Bonjour ! Je suis {ASSISTANT_NAME}. Comment puis-je vous assister avec vos problèmes techniques aujourd'hui ?"
+LISTEN_ERROR_RESPONSE = "Désolé, une erreur s'est produite lors de l'écoute."
+GOODBYE_RESPONSE = "Support terminé. Au revoir !"
+NOT_HEARD_RESPONSE = "Je n'ai pas bien entendu. Pouvez-vous décrire votre problème technique ?"
 
-# --- Main Loop ---
-# (This section remains the same)
-if __name__ == "__main__":
-    try:
-         sd.check_output_settings(device=OUTPUT_DEVICE, samplerate=PIPER_SAMPLE_RATE)
-         print("Audio output device check successful.")
-    except Exception as e:
-         print(f"Warning: Audio output device check failed: {e}. Playback might have issues.")
+def static_responses():
+    """Every reply whose text never changes, i.e. everything except the time, the date and the fallback."""
+    responses = [GREETING_RESPONSE, LISTEN_ERROR_RESPONSE, GOODBYE_RESPONSE, NOT_HEARD_RESPONSE, intent_matcher.empty]
+    responses += intent_matcher.static_responses()
+    return list(dict.fromkeys(responses))
 
+STATIC_RESPONSES = frozenset() # Filled in by load_intents()
+
+def warm_tts_cache():
+    """Pre-renders every static response into the TTS cache (run once at install time)."""
+    print(f"--- Warming TTS cache in '{TTS_CACHE_DIR}' ---")
+    start = time.perf_counter()
+    segments = list(dict.fromkeys(segment for response in STATIC_RESPONSES for segment in split_for_speech(response)))
+    rendered = 0
+    for segment in segments:
+        if tts_cache.get(segment) is None:
+            tts_engine.render(segment, store=True)
+            rendered += 1
+    cache_bytes = sum(entry.stat().st_size for entry in os.scandir(TTS_CACHE_DIR) if entry.name.endswith(".pcm"))
+    print(f"{len(segments)} segment(s) from {len(STATIC_RESPONSES)} static response(s): {rendered} rendered, "
+          f"{len(segments) - rendered} already cached ({cache_bytes / 1e6:.1f} MB on disk) in {time.perf_counter() - start:.1f}s.")
+
+# --- Conversation Loop (run_assistant) ---
+def run_assistant(source, sink):
+    """Greets the user, then listens, routes and replies until goodbye or the end of the input.
+
+    `source` and `sink` are the live devices (MicrophoneSource, SoundCardSink)
+    or headless stand-ins (WavReplaySource, NullSink, WavFileSink).
+    """
+    global audio_source
+    audio_source = source
+    init_audio(sink)
     try:
-        # Changed initial greeting
-        speak(f"Bonjour ! Je suis {ASSISTANT_NAME}. Comment puis-je vous assister avec vos problèmes techniques aujourd'hui ?")
-        while True:
-            command = listen()
-            if command is None:
-                 speak("Désolé, une erreur s'est produite lors de l'écoute.")
-                 time.sleep(2)
-                 continue
-            if command == "__keyboard_interrupt__":
-                 speak("Support terminé. Au revoir !")
-                 break
-            if command:
-                response = process_command(command)
-                if response is None: # Exit signal
-                    break
-                elif response:
-                    speak(response)
-            else:
-                 speak("Je n'ai pas bien entendu. Pouvez-vous décrire votre problème technique ?")
+        audio_output.start()
+        # The microphone stays open while replies play, so the user can interrupt them.
+        with source.open(audio_callback):
+            speak(GREETING_RESPONSE)
+            while True:
+                command = listen()
+                if command == "__end_of_input__":
+                     break
+                if command is None:
+                     speak(LISTEN_ERROR_RESPONSE)
+                     time.sleep(2)
+                     continue
+                if command == "__keyboard_interrupt__":
+                     speak(GOODBYE_RESPONSE)
+                     break
+                if command:
+                    response = process_command(command)
+                    metrics.mark("intent")
+                    if response is None: # Exit signal
+                        break
+                    elif response:
+                        speak(response)
+                else:
+                     speak(NOT_HEARD_RESPONSE)
 
     except KeyboardInterrupt:
         print("\nArrêt de l'assistant demandé.")
@@ -381,4 +1922,753 @@ if __name__ == "__main__":
         traceback.print_exc()
     finally:
         print("Assistant terminé.")
-        sd.stop()
\ No newline at end of file
+        audio_output.close()
+
+# --- STT Server (one shared vosk.Model, one recognizer per connection) ---
+# Wire format, both directions over plain TCP:
+#   client -> server: frames of a 4-byte big-endian length followed by int16 mono PCM at
+#                     VOSK_SAMPLE_RATE; a zero-length frame ends the utterance.
+#   server -> client: one JSON object per line, as Vosk returns them: {"partial": ...} while
+#                     decoding, {"text": ...} on an endpoint, and {"text": ..., "final": true}
+#                     in answer to the zero-length frame.
+STT_FRAME_HEADER = struct.Struct(">I")
+
+def decode_stt_frame(recognizer, data):
+    """Feeds one frame and returns the recognizer's answer as a dict. Runs on the decoder pool: with
+    --grammar, Result() may re-decode the whole utterance, which must not block the event loop."""
+    if recognizer.AcceptWaveform(data):
+        return json.loads(recognizer.Result())
+    return json.loads(recognizer.PartialResult())
+
+async def handle_stt_session(reader, writer, executor):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    peer = writer.get_extra_info('peername')
+    recognizer = await loop.run_in_executor(executor, create_recognizer, stt_model)
+    last_partial = ""
+    print(f"STT session opened: {peer}")
+    try:
+        while True:
+            (length,) = STT_FRAME_HEADER.unpack(await reader.readexactly(STT_FRAME_HEADER.size))
+            if length > STT_SERVER_MAX_FRAME_BYTES:
+                print(f"STT session {peer}: frame of {length} bytes rejected.")
+                break
+            if length == 0:
+                result = json.loads(await loop.run_in_executor(executor, recognizer.FinalResult))
+                result["final"] = True
+                last_partial = ""
+            else:
+                data = await reader.readexactly(length)
+                # The decoder releases the GIL, so sessions decode in parallel on the pool's threads.
+                result = await loop.run_in_executor(executor, decode_stt_frame, recognizer, data)
+                if "partial" in result:
+                    if result["partial"] == last_partial:
+                        continue
+                    last_partial = result["partial"]
+                else: # Endpoint
+                    last_partial = ""
+            writer.write((json.dumps(result, ensure_ascii=False) + "\n").encode('utf-8'))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass # Client went away
+    finally:
+        print(f"STT session closed: {peer}")
+        writer.close()
+
+async def serve_stt(host=STT_SERVER_HOST, port=STT_SERVER_PORT, threads=STT_SERVER_THREADS):
+    import asyncio
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="stt")
+    server = await asyncio.start_server(lambda reader, writer: handle_stt_session(reader, writer, executor), host, port)
+    print(f"STT server listening on {host}:{port} ({threads} decoder thread(s)).")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        # Cancelling the sessions already cancelled their queued decodes (run_in_executor propagates it).
+        executor.shutdown(wait=False)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+async def _stt_load_stream(host, port, wav_path, speed, chunk_frames):
+    import asyncio
+    with wave.open(wav_path, 'rb') as wav_file:
+        if wav_file.getframerate() != VOSK_SAMPLE_RATE or wav_file.getnchannels() != 1 or wav_file.getsampwidth() != 2:
+            raise ValueError(f"{wav_path}: expected 16-bit mono at {VOSK_SAMPLE_RATE} Hz")
+        audio_seconds = wav_file.getnframes() / VOSK_SAMPLE_RATE
+        reader, writer = await asyncio.open_connection(host, port)
+        start = time.perf_counter()
+        sent_seconds = 0.0
+        while True:
+            data = wav_file.readframes(chunk_frames)
+            if not data:
+                break
+            writer.write(STT_FRAME_HEADER.pack(len(data)) + data)
+            await writer.drain()
+            sent_seconds += len(data) / 2 / VOSK_SAMPLE_RATE
+            if speed > 0: # Pace the stream like a live microphone (speed 0 = as fast as possible)
+                ahead = sent_seconds / speed - (time.perf_counter() - start)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+    end_of_speech = time.perf_counter()
+    writer.write(STT_FRAME_HEADER.pack(0))
+    await writer.drain()
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError(f"{wav_path}: server closed the connection before the final result")
+        result = json.loads(line)
+        if result.get("final"):
+            break
+    finished = time.perf_counter()
+    writer.close()
+    return audio_seconds, finished - start, finished - end_of_speech, result.get("text", "")
+
+async def run_stt_load_test(host, port, wav_paths, streams, speed, chunk_frames=BLOCK_SIZE):
+    """Replays the WAV files over `streams` concurrent connections and reports RTF and finalization latency."""
+    import asyncio
+    print(f"--- STT load test: {streams} stream(s) against {host}:{port}, speed {speed or 'unpaced'} ---")
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_stt_load_stream(host, port, wav_paths[i % len(wav_paths)], speed, chunk_frames)
+                                     for i in range(streams)))
+    wall_seconds = time.perf_counter() - start
+    audio_total = sum(audio_seconds for audio_seconds, _, _, _ in results)
+    stream_rtf = [elapsed / audio_seconds for audio_seconds, elapsed, _, _ in results if audio_seconds > 0]
+    latencies = [latency * 1000 for _, _, latency, _ in results]
+    print(f"Audio: {audio_total:.1f}s in {wall_seconds:.1f}s wall ({audio_total / wall_seconds:.1f}x real time overall)")
+    print(f"Per-stream real-time factor: mean {sum(stream_rtf) / len(stream_rtf):.3f}, max {max(stream_rtf):.3f}")
+    print(f"Finalization latency: p50 {percentile(latencies, 50):.0f} ms, p99 {percentile(latencies, 99):.0f} ms")
+
+# --- Resampling ---
+class PolyphaseResampler:
+    """Streaming rational resampler (windowed-sinc polyphase FIR), vectorized with NumPy.
+
+    Feed int16 chunks of any size to process(); filter state carries over
+    between chunks, so a long file can be converted block by block.
+    """
+
+    def __init__(self, from_rate, to_rate, taps_per_phase=RESAMPLER_TAPS_PER_PHASE):
+        divisor = math.gcd(int(from_rate), int(to_rate))
+        self.up = int(to_rate) // divisor
+        self.down = int(from_rate) // divisor
+        self.taps = taps_per_phase
+        self.phases = self._design(self.up, self.down, taps_per_phase)
+        self.history = np.zeros(taps_per_phase - 1, dtype=np.float32)
+        self.inputs_seen = 0 # Global index of the next input sample
+        self.next_output = 0 # Global index of the next output sample
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _design(up, down, taps_per_phase):
+        """The filter only depends on the ratio, so each one is designed once (one resampler is created per reply)."""
+        length = up * taps_per_phase
+        cutoff = 0.5 / max(up, down) * 0.95 # In cycles per sample of the upsampled signal
+        n = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, 8.0) * up
+        # phases[p, j] is the tap applied to input sample k - j for output phase p
+        return prototype.reshape(taps_per_phase, up).T.astype(np.float32)
+
+    def output_length(self, input_frames):
+        """Number of samples process() returns for `input_frames` samples in total."""
+        return (input_frames * self.up - 1) // self.down + 1 if input_frames else 0
+
+    def process(self, samples, out=None):
+        """Returns the int16 output samples that the new input completes.
+
+        With `out`, they are written to the start of that int16 array and the
+        filled part of it is returned instead of a new array.
+        """
+        if self.up == self.down:
+            if out is None:
+                return np.asarray(samples, dtype=np.int16)
+            out[:len(samples)] = samples
+            return out[:len(samples)]
+        buffer = np.concatenate((self.history, np.asarray(samples, dtype=np.float32)))
+        buffer_start = self.inputs_seen - self.history.size
+        self.inputs_seen += len(samples)
+        # Output n reads input sample (n * down) // up and the taps - 1 before it.
+        last_output = (self.inputs_seen * self.up - 1) // self.down
+        outputs = np.arange(self.next_output, last_output + 1, dtype=np.int64)
+        self.next_output = last_output + 1
+        self.history = buffer[-(self.taps - 1):]
+        if outputs.size == 0:
+            return np.zeros(0, dtype=np.int16) if out is None else out[:0]
+        positions = outputs * self.down
+        windows = buffer[(positions // self.up - buffer_start)[:, None] - np.arange(self.taps)[None, :]]
+        result = np.einsum('ij,ij->i', windows, self.phases[positions % self.up])
+        np.clip(np.rint(result, out=result), -32768, 32767, out=result)
+        if out is None:
+            return result.astype(np.int16)
+        out[:result.size] = result
+        return out[:result.size]
+
+def resample_audio(samples, from_rate, to_rate, chunk_frames=OUTPUT_RESAMPLE_CHUNK_FRAMES):
+    """Converts a whole reply segment, in fixed-size chunks, into one preallocated int16 array.
+
+    Working on chunks keeps the filter's temporary arrays small and the same
+    size whatever the length of the segment.
+    """
+    resampler = PolyphaseResampler(from_rate, to_rate)
+    output = np.empty(resampler.output_length(len(samples)), dtype=np.int16)
+    filled = 0
+    for start in range(0, len(samples), chunk_frames):
+        filled += len(resampler.process(samples[start:start + chunk_frames], out=output[filled:]))
+    return output[:filled]
+
+# --- Batch Transcription ---
+_batch_model = None
+
+_batch_use_grammar = False
+
+def _batch_worker_init(model_path, use_grammar):
+    """Pool initializer: each worker process loads the Vosk model once and reuses it for every file."""
+    global _batch_model, _batch_use_grammar
+    import vosk
+    vosk.SetLogLevel(-1)
+    _batch_use_grammar = use_grammar
+    _batch_model = vosk.Model(model_path)
+    if intent_matcher is None: # Spawned workers start from a fresh import
+        load_intents()
+
+def iter_audio_chunks(path, raw_sample_rate=VOSK_SAMPLE_RATE, chunk_frames=BATCH_CHUNK_FRAMES):
+    """Yields int16 mono chunks at VOSK_SAMPLE_RATE from a WAV or headerless raw file, without reading it whole."""
+    if path.lower().endswith(".wav"):
+        source = wave.open(path, 'rb')
+        if source.getsampwidth() != 2:
+            source.close()
+            raise ValueError(f"{path}: only 16-bit PCM WAV files are supported")
+        channels, sample_rate = source.getnchannels(), source.getframerate()
+        read = source.readframes
+    else:
+        source = open(path, 'rb')
+        channels, sample_rate = 1, raw_sample_rate
+        read = lambda frames: source.read(frames * 2)
+    resampler = PolyphaseResampler(sample_rate, VOSK_SAMPLE_RATE) if sample_rate != VOSK_SAMPLE_RATE else None
+    with source:
+        while True:
+            data = read(chunk_frames)
+            if not data:
+                break
+            samples = np.frombuffer(data, dtype=np.int16, count=len(data) // 2) # A truncated raw file can end on half a sample
+            if not samples.size:
+                break
+            if channels > 1:
+                samples = samples[:samples.size - samples.size % channels].reshape(-1, channels).mean(axis=1).astype(np.int16)
+            yield resampler.process(samples) if resampler else samples
+
+def transcribe_file(job):
+    """Worker entry point: (path, raw sample rate) -> JSON-ready result dict."""
+    path, raw_sample_rate = job
+    start = time.perf_counter()
+    try:
+        recognizer = create_recognizer(_batch_model, _batch_use_grammar)
+        texts = []
+        audio_frames = 0
+        for samples in iter_audio_chunks(path, raw_sample_rate):
+            audio_frames += samples.size
+            if recognizer.AcceptWaveform(samples.tobytes()):
+                texts.append(json.loads(recognizer.Result()).get("text", ""))
+        texts.append(json.loads(recognizer.FinalResult()).get("text", ""))
+        text = " ".join(t for t in texts if t)
+        intent, _ = route_command(text.lower().strip())
+        return {"path": path, "text": text, "intent": intent, "audio_seconds": round(audio_frames / VOSK_SAMPLE_RATE, 3),
+                "decode_seconds": round(time.perf_counter() - start, 3)}
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
+def collect_batch_jobs(source, raw_sample_rate=VOSK_SAMPLE_RATE):
+    """Lists (path, raw sample rate) jobs from a directory tree or a manifest.
+
+    A manifest is either one path per line, or JSON lines with a "path" and an
+    optional "sample_rate" for raw files.
+    """
+    if os.path.isdir(source):
+        return [(os.path.join(root, name), raw_sample_rate)
+                for root, _, names in sorted(os.walk(source)) for name in sorted(names)
+                if name.lower().endswith((".wav", ".raw"))]
+    base_dir = os.path.dirname(os.path.abspath(source))
+    jobs = []
+    with open(source, 'r', encoding='utf-8') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                path, rate = entry["path"], entry.get("sample_rate", raw_sample_rate)
+            else:
+                path, rate = line, raw_sample_rate
+            jobs.append((os.path.join(base_dir, path), rate))
+    return jobs
+
+def run_batch_transcription(source, output_path, processes=None, raw_sample_rate=VOSK_SAMPLE_RATE):
+    """Transcribes every file from `source` across a process pool and writes one JSON line per file."""
+    import multiprocessing
+    from tqdm import tqdm
+    jobs = collect_batch_jobs(source, raw_sample_rate)
+    processes = processes or os.cpu_count() or 1
+    print(f"--- Batch transcription: {len(jobs)} file(s), {processes} process(es) -> {output_path} ---")
+    start = time.perf_counter()
+    audio_seconds = 0.0
+    failures = 0
+    with multiprocessing.Pool(processes, initializer=_batch_worker_init, initargs=(VOSK_MODEL_PATH, STT_GRAMMAR)) as pool, \
+         open(output_path, 'w', encoding='utf-8') as output:
+        for result in tqdm(pool.imap_unordered(transcribe_file, jobs), total=len(jobs), unit="file", desc="Transcribing"):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            if "error" in result:
+                failures += 1
+                tqdm.write(f"Error transcribing {result['path']}: {result['error']}")
+            else:
+                audio_seconds += result["audio_seconds"]
+    wall_seconds = time.perf_counter() - start
+    print(f"Transcribed {audio_seconds / 3600:.2f} h of audio in {wall_seconds / 3600:.3f} h wall clock: "
+          f"{audio_seconds / wall_seconds:.1f} audio-hours per hour ({failures} failure(s)).")
+
+# --- Benchmarks ---
+def check_intents(corpus_path=INTENTS_CORPUS_PATH):
+    """Replays the regression corpus through route_command; returns the number of mismatches."""
+    mismatches = 0
+    total = 0
+    with open(corpus_path, 'r', encoding='utf-8') as corpus:
+        for line in corpus:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            total += 1
+            intent, response = route_command(case["command"])
+            # Time and date cases only record the intent; their text changes every minute.
+            if intent != case["intent"] or ("response" in case and response != case["response"]):
+                mismatches += 1
+                print(f"MISMATCH {case['command']!r}: expected {case['intent']}, got {intent}")
+    print(f"{total - mismatches}/{total} corpus command(s) routed as expected.")
+    return mismatches
+
+def _route_linearly(intents, command):
+    """Reference router: tests every intent's keywords with `in`, in priority order, like the old if/elif chain."""
+    for entry in intents:
+        if "equals" in entry and command not in entry["equals"]:
+            continue
+        if "any" in entry and not any(keyword in command for keyword in entry["any"]):
+            continue
+        if all(any(keyword in command for keyword in group) for group in entry.get("all", [])):
+            return entry["name"]
+    return None
+
+def benchmark_intents(synthetic_count=3000, command_count=2000):
+    """Times the compiled matcher against a linear scan on the real table plus synthetic intents."""
+    rng = random.Random(0)
+    syllables = ["ba", "co", "di", "fu", "ga", "lo", "mi", "ne", "pa", "ri", "so", "tu", "ve", "xo", "za"]
+    make_word = lambda: "".join(rng.choice(syllables) for _ in range(4))
+    table = load_intent_table(INTENTS_PATH)
+    for index in range(synthetic_count):
+        entry = {"name": f"synthetic_{index}", "priority": 1000 + index, "any": [make_word() for _ in range(3)], "response": "..."}
+        if index % 2:
+            entry["all"] = [[make_word(), make_word()]]
+        table["intents"].append(entry)
+    start = time.perf_counter()
+    matcher = IntentMatcher(table)
+    compile_seconds = time.perf_counter() - start
+    ordered = sorted(table["intents"], key=lambda entry: entry.get("priority", 0))
+    commands = []
+    for _ in range(command_count):
+        words = [rng.choice(rng.choice(table["intents"]).get("any", ["merci"])) for _ in range(rng.randint(1, 3))]
+        commands.append(" ".join(words + [make_word()]))
+    start = time.perf_counter()
+    compiled = [matcher.match(command)[0] for command in commands]
+    compiled_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    linear = [_route_linearly(ordered, command) for command in commands]
+    linear_seconds = time.perf_counter() - start
+    disagreements = sum((intent.name if intent else None) != name for intent, name in zip(compiled, linear))
+    print(f"--- Intent benchmark: {len(table['intents'])} intents, {len(matcher.keywords)} keywords, {command_count} commands ---")
+    print(f"Compile: {compile_seconds * 1000:.0f} ms")
+    print(f"Compiled automaton: {compiled_seconds / command_count * 1e6:.1f} us/command")
+    print(f"Linear scan:        {linear_seconds / command_count * 1e6:.1f} us/command ({linear_seconds / compiled_seconds:.0f}x slower)")
+    print(f"Disagreements: {disagreements}")
+
+def load_labelled_set(source):
+    """(path, expected transcript) pairs: a directory of WAV files with same-named .txt
+    transcripts, or a JSONL manifest of {"path": ..., "text": ...}."""
+    if os.path.isdir(source):
+        pairs = []
+        for name in sorted(os.listdir(source)):
+            transcript = os.path.join(source, os.path.splitext(name)[0] + ".txt")
+            if name.lower().endswith(".wav") and os.path.exists(transcript):
+                with open(transcript, 'r', encoding='utf-8') as f:
+                    pairs.append((os.path.join(source, name), f.read().strip().lower()))
+        return pairs
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as manifest:
+        return [(os.path.join(base_dir, entry["path"]), entry["text"].lower())
+                for entry in map(json.loads, filter(str.strip, manifest))]
+
+def _decode_for_benchmark(recognizer, path):
+    """Decodes one file; returns (text, CPU seconds, audio seconds)."""
+    chunks = list(iter_audio_chunks(path)) # Read up front so file I/O is not timed
+    start = time.process_time()
+    texts = []
+    for samples in chunks:
+        if recognizer.AcceptWaveform(samples.tobytes()):
+            texts.append(json.loads(recognizer.Result()).get("text", ""))
+    texts.append(json.loads(recognizer.FinalResult()).get("text", ""))
+    return " ".join(text for text in texts if text), time.process_time() - start, sum(chunk.size for chunk in chunks) / VOSK_SAMPLE_RATE
+
+def benchmark_grammar(source):
+    """Compares open-vocabulary and grammar-first decoding: CPU time, keyword recall and intent accuracy."""
+    pairs = load_labelled_set(source)
+    if not pairs:
+        print(f"No labelled recordings found in '{source}'.")
+        return
+    print(f"--- Grammar benchmark: {len(pairs)} recording(s) ---")
+    for label, use_grammar in (("open vocabulary", False), ("grammar + fallback", True)):
+        recognizer = create_recognizer(stt_model, use_grammar)
+        cpu_seconds = audio_seconds = 0.0
+        expected_keywords = found_keywords = intents_correct = 0
+        for path, expected in pairs:
+            text, cpu, audio = _decode_for_benchmark(recognizer, path)
+            cpu_seconds += cpu
+            audio_seconds += audio
+            expected_hits = intent_matcher.automaton.find(expected)
+            expected_keywords += len(expected_hits)
+            found_keywords += len(expected_hits & intent_matcher.automaton.find(text))
+            intents_correct += route_command(text)[0] == route_command(expected)[0]
+        summary = f"{label:>18}: {cpu_seconds / audio_seconds:.3f} CPU s per audio s, keyword recall " \
+                  f"{found_keywords / max(1, expected_keywords):.1%}, intent accuracy {intents_correct / len(pairs):.1%}"
+        if use_grammar:
+            summary += f", open-vocabulary fallback on {recognizer.fallbacks}/{recognizer.utterances} utterance(s)"
+        print(summary)
+
+def benchmark_front_end(wav_paths, idle_seconds=30):
+    """End-of-speech-to-text latency and idle CPU, for the old front end (0.5 s blocks, no VAD) and the current one."""
+    rng = np.random.default_rng(0)
+    room_noise = lambda seconds: rng.normal(0, 30, int(seconds * VOSK_SAMPLE_RATE)).astype(np.int16) # About -60 dBFS
+    configurations = [("before (8000-frame blocks, no VAD)", dict(use_vad=False, block_size=8000)),
+                      (f"after ({BLOCK_SIZE}-frame blocks, VAD {'on' if VAD_ENABLED else 'off'})", dict())]
+    print(f"--- Front-end benchmark: {len(wav_paths)} recording(s), {idle_seconds}s idle ---")
+    block_bytes = CAPTURE_BLOCK_SIZE * 2
+    for label, options in configurations:
+        latencies = []
+        for path in wav_paths:
+            speech = np.concatenate(list(iter_audio_chunks(path)))
+            stream = np.concatenate((room_noise(1), speech, room_noise(3))).tobytes()
+            speech_end = (VOSK_SAMPLE_RATE + speech.size) * 2 # Byte offset where the speaker stops
+            front_end = SpeechFrontEnd(create_recognizer(stt_model), **options)
+            ring = AudioRingBuffer(CAPTURE_RING_SECONDS * VOSK_SAMPLE_RATE)
+            latency = None
+            for offset in range(0, len(stream), block_bytes):
+                started = time.perf_counter()
+                ring.write(np.frombuffer(stream[offset:offset + block_bytes], dtype=np.int16))
+                event = front_end.poll(ring, timeout=0)
+                if event and event[0] == "final" and event[1] and offset + block_bytes >= speech_end:
+                    # Audio still to be captured after the speaker stopped, plus decoding time.
+                    latency = (offset + block_bytes - speech_end) / 2 / VOSK_SAMPLE_RATE + time.perf_counter() - started
+                    break
+            if latency is None: # Never endpointed: the caller has to wait for the end of the stream
+                started = time.perf_counter()
+                front_end.recognizer.FinalResult()
+                latency = (len(stream) - speech_end) / 2 / VOSK_SAMPLE_RATE + time.perf_counter() - started
+            latencies.append(latency * 1000)
+        front_end = SpeechFrontEnd(create_recognizer(stt_model), **options)
+        ring = AudioRingBuffer(CAPTURE_RING_SECONDS * VOSK_SAMPLE_RATE)
+        idle = room_noise(idle_seconds)
+        started = time.process_time()
+        for offset in range(0, idle.size, CAPTURE_BLOCK_SIZE):
+            ring.write(idle[offset:offset + CAPTURE_BLOCK_SIZE])
+            front_end.poll(ring, timeout=0)
+        idle_cpu = (time.process_time() - started) / idle_seconds
+        print(f"{label}: end of speech to text p50 {percentile(latencies, 50):.0f} ms, max {max(latencies):.0f} ms; "
+              f"idle CPU {idle_cpu:.1%} of a core")
+
+def synthesize_cold(text):
+    """The original one-process-per-utterance path. Returns (time to first audio, total time)."""
+    start = time.perf_counter()
+    command = [PIPER_EXE_PATH, '--model', PIPER_VOICE_MODEL, '--output_raw']
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdin.write(text.encode('utf-8'))
+    process.stdin.close()
+    first_chunk = process.stdout.read1(4096)
+    first_audio = time.perf_counter() - start
+    while first_chunk:
+        first_chunk = process.stdout.read1(65536)
+    process.wait()
+    return first_audio, time.perf_counter() - start
+
+def benchmark_tts():
+    """Compares cold (new process) and warm (TTSEngine) time-to-first-audio on the canned responses."""
+    responses = static_responses()
+    print(f"--- TTS benchmark: {len(responses)} canned responses ---")
+    print(f"{'chars':>6} {'cold TTFA':>10} {'warm TTFA':>10}  response")
+    cold_times, warm_times = [], []
+    # Measure the warm workers themselves, not the PCM cache in front of them.
+    cache, tts_engine.cache = tts_engine.cache, None
+    for response in responses:
+        cold_first_audio, _ = synthesize_cold(response)
+        start = time.perf_counter()
+        stream = tts_engine.synthesize_stream(split_for_speech(response))
+        next(stream) # First audio is the first segment, as in speak()
+        warm_first_audio = time.perf_counter() - start
+        for _ in stream:
+            pass
+        cold_times.append(cold_first_audio)
+        warm_times.append(warm_first_audio)
+        summary = response.splitlines()[0][:50]
+        print(f"{len(response):>6} {cold_first_audio * 1000:>8.0f}ms {warm_first_audio * 1000:>8.0f}ms  {summary}")
+    tts_engine.cache = cache
+    cold_mean = sum(cold_times) / len(cold_times)
+    warm_mean = sum(warm_times) / len(warm_times)
+    print(f"Mean time to first audio: cold {cold_mean * 1000:.0f}ms, warm {warm_mean * 1000:.0f}ms "
+          f"({cold_mean / warm_mean:.1f}x)")
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where the resource module is missing (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # Bytes on macOS, KB elsewhere
+
+def benchmark_conversations(scripts, speed=1.0, baseline_path=BENCH_BASELINE_PATH, update_baseline=False, record_path=None):
+    """Drives scripted conversations through run_assistant() with a WAV replay source and a headless sink.
+
+    Each script is a labelled set (see load_labelled_set): one recording per
+    user turn, in order. Reports per-turn latency, real-time factor, CPU and
+    peak RSS, and compares them with the stored baseline. Returns the number
+    of metrics that regressed.
+    """
+    responses, turns = [], []
+    audio_seconds = wall_seconds = cpu_seconds = 0.0
+    for script_path in scripts:
+        script = load_labelled_set(script_path)
+        print(f"--- Conversation '{script_path}': {len(script)} turn(s) at {speed:g}x ---")
+        if isinstance(stt_front_end.recognizer, StubRecognizer):
+            stt_front_end.recognizer.transcripts = collections.deque(text for _, text in script)
+        stt_front_end.reset()
+        metrics.turn_log = []
+        source = WavReplaySource([path for path, _ in script], speed)
+        sink = WavFileSink(record_path, speed) if record_path else NullSink(speed)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        run_assistant(source, sink)
+        wall_seconds += time.perf_counter() - wall_start
+        cpu_seconds += time.process_time() - cpu_start
+        audio_seconds += source.audio_seconds
+        for index, turn in enumerate(metrics.turn_log, 1):
+            if "endpoint" in turn and "playback_start" in turn:
+                responses.append(turn["playback_start"] - turn["endpoint"])
+            turns.append(turn[TURN_STAGES[-1]] if TURN_STAGES[-1] in turn else max(turn.values()))
+            print(f"  turn {index}: " + ", ".join(f"{stage} +{turn[stage] * 1000:.0f} ms" for stage in TURN_STAGES[1:] if stage in turn))
+    metrics.turn_log = None
+    if not turns or not audio_seconds:
+        print("No turn completed; check the scripts (and --stub-stt without models).")
+        return 1
+    results = {
+        "response_p50_ms": percentile(responses, 50) * 1000 if responses else None,
+        "response_p95_ms": percentile(responses, 95) * 1000 if responses else None,
+        "turn_p50_ms": percentile(turns, 50) * 1000,
+        "real_time_factor": cpu_seconds / audio_seconds, # CPU seconds of this process per second of user speech
+        "cpu_percent": cpu_seconds / wall_seconds * 100,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"--- {len(turns)} turn(s), {audio_seconds:.1f}s of user speech, {wall_seconds:.1f}s wall clock ---")
+    for name, value in results.items():
+        print(f"{name:>22}: " + ("n/a" if value is None else f"{value:.3f}"))
+
+    if not baseline_path:
+        return 0
+    if update_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to '{baseline_path}'.")
+        return 0
+    if not os.path.exists(baseline_path): # A CI run without a baseline must not pass silently
+        print(f"ERROR: baseline '{baseline_path}' not found; run with --update-baseline to create it.")
+        return 1
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = 0
+    for name, value in results.items():
+        reference = baseline.get(name)
+        if value is None or not reference:
+            continue
+        if value > reference * (1 + BENCH_REGRESSION_TOLERANCE):
+            regressions += 1
+            print(f"REGRESSION: {name} is {value:.3f}, baseline {reference:.3f} (+{(value / reference - 1) * 100:.0f}%)")
+    print(f"{regressions} regression(s) against '{baseline_path}' (tolerance {BENCH_REGRESSION_TOLERANCE * 100:.0f}%).")
+    return regressions
+
+def benchmark_startup(runs=3):
+    """Reports the import cost (python -X importtime) and the wall-clock time from launch to the
+    greeting being heard and to the first "Listening...", starting the assistant as a child process."""
+    script = os.path.abspath(__file__)
+    print("--- Startup benchmark ---")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {os.path.splitext(os.path.basename(script))[0]}"],
+                            cwd=os.path.dirname(script), capture_output=True, text=True)
+    # Each line is "import time: self | cumulative | <indent>module"; a module's imports are listed just before it, one level deeper.
+    entries = []
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        entries.append(((len(name) - len(name.lstrip())) // 2, int(fields[1]), name.strip()))
+    if not entries or entries[-1][0] != 0:
+        print(f"Could not import the assistant:\n{result.stderr[-2000:]}")
+        return
+    direct = []
+    for depth, cumulative, name in reversed(entries[:-1]):
+        if depth == 0:
+            break
+        if depth == 1:
+            direct.append((cumulative, name))
+    print(f"Import: {entries[-1][1] / 1000:.0f} ms. Slowest direct imports:")
+    for cumulative, name in sorted(direct, reverse=True)[:8]:
+        print(f"  {name:<24} {cumulative / 1000:7.1f} ms")
+
+    greeting_times, listening_times = [], []
+    for run in range(1, runs + 1):
+        start = time.perf_counter()
+        child = subprocess.Popen([sys.executable, "-u", script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 text=True, encoding='utf-8', errors='replace')
+        greeting = first_audio = listening = None
+        output = collections.deque(maxlen=20)
+        try:
+            for line in child.stdout:
+                elapsed = time.perf_counter() - start
+                output.append(line.rstrip())
+                match = re.search(r"\(TTS: first audio after (\d+) ms", line)
+                if greeting is None and line.startswith(f"{ASSISTANT_NAME}: "):
+                    greeting = elapsed # speak() called: TTS ready and the output stream open
+                elif first_audio is None and match:
+                    first_audio = int(match.group(1)) / 1000
+                elif "Listening..." in line:
+                    listening = elapsed
+                    break
+        finally:
+            child.terminate()
+            child.wait()
+        if greeting is None or listening is None:
+            print(f"Run {run}: the assistant did not reach the listening state. Last output:\n" + "\n".join(output))
+            return
+        greeting += first_audio or 0.0
+        greeting_times.append(greeting)
+        listening_times.append(listening)
+        print(f"Run {run}: greeting audio after {greeting:.2f}s, listening after {listening:.2f}s")
+    print(f"Median over {runs} run(s): greeting {sorted(greeting_times)[runs // 2]:.2f}s, "
+          f"listening {sorted(listening_times)[runs // 2]:.2f}s")
+
+# --- Main Loop ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"{ASSISTANT_NAME} - offline French voice assistant")
+    parser.add_argument("--bench-tts", action="store_true", help="compare cold and warm Piper time-to-first-audio, then exit")
+    parser.add_argument("--warm-tts-cache", action="store_true", help="pre-render every static response into the TTS cache, then exit")
+    parser.add_argument("--serve-stt", action="store_true", help="run the multi-session STT server instead of the assistant")
+    parser.add_argument("--host", help=f"STT server address (default {STT_SERVER_HOST} for the server, 127.0.0.1 for the load test)")
+    parser.add_argument("--port", type=int, default=STT_SERVER_PORT, help="STT server port (server and load test)")
+    parser.add_argument("--threads", type=int, default=STT_SERVER_THREADS, help="STT server decoder threads")
+    parser.add_argument("--stt-load-test", nargs="+", metavar="WAV", help="replay 16 kHz mono WAV files against the STT server, then exit")
+    parser.add_argument("--streams", type=int, default=8, help="concurrent streams for --stt-load-test")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed for --stt-load-test (1 = real time, 0 = unpaced) and --bench-conversations (> 0)")
+    parser.add_argument("--batch", metavar="DIR_OR_MANIFEST", help="transcribe a directory or manifest of WAV/raw files, then exit")
+    parser.add_argument("--batch-output", default="transcripts.jsonl", help="JSONL output file for --batch")
+    parser.add_argument("--processes", type=int, help="worker processes for --batch (default: one per core)")
+    parser.add_argument("--raw-sample-rate", type=int, default=VOSK_SAMPLE_RATE, help="sample rate of headerless .raw files")
+    parser.add_argument("--check-intents", nargs="?", const=INTENTS_CORPUS_PATH, metavar="CORPUS", help="check routing against the regression corpus, then exit")
+    parser.add_argument("--bench-intents", action="store_true", help="time the compiled intent matcher on a few thousand synthetic intents, then exit")
+    parser.add_argument("--grammar", action="store_true", help="decode against the intent vocabulary first (assistant, server and batch)")
+    parser.add_argument("--bench-grammar", metavar="DIR_OR_MANIFEST", help="compare open and grammar-first decoding on labelled recordings, then exit")
+    parser.add_argument("--bench-front-end", nargs="+", metavar="WAV", help="measure endpoint latency and idle CPU with and without the VAD, then exit")
+    parser.add_argument("--metrics-port", type=int, help="serve per-stage latency histograms in Prometheus text format on this port")
+    parser.add_argument("--metrics-host", default=METRICS_HOST, help=f"address for --metrics-port (default {METRICS_HOST})")
+    parser.add_argument("--metrics-jsonl", metavar="PATH", help=f"append every turn and a histogram snapshot every {METRICS_DUMP_SECONDS}s to a JSONL file")
+    parser.add_argument("--profile", nargs="?", const="profile.folded", metavar="PATH", help="sample all thread stacks and write them in folded (flamegraph) form on exit")
+    parser.add_argument("--bench-startup", nargs="?", type=int, const=3, metavar="RUNS", help="measure import time and time to the greeting and to listening, then exit")
+    parser.add_argument("--provision", nargs="?", const=MODELS_MANIFEST_PATH, metavar="MANIFEST", help="download and extract the models listed in the manifest, then exit")
+    parser.add_argument("--allow-unpinned", action="store_true", help="with --provision, also download artifacts that have no sha256 in the manifest")
+    parser.add_argument("--bench-conversations", nargs="+", metavar="SCRIPT", help="replay scripted conversations (labelled sets) through the assistant loop without audio devices, report latency, RTF, CPU and memory, then exit")
+    parser.add_argument("--stub-stt", action="store_true", help="with --bench-conversations: scripted transcripts instead of the Vosk model")
+    parser.add_argument("--stub-tts", action="store_true", help="with --bench-conversations: generated tones instead of Piper")
+    parser.add_argument("--baseline", default=BENCH_BASELINE_PATH, help="baseline file for --bench-conversations")
+    parser.add_argument("--update-baseline", action="store_true", help="write this run's results as the baseline (required when it does not exist yet)")
+    parser.add_argument("--record-output", metavar="WAV", help="with --bench-conversations: record what would have been played")
+    args = parser.parse_args()
+    if args.profile:
+        SamplingProfiler(args.profile).start()
+    if args.grammar:
+        STT_GRAMMAR = True # Before load_stt() builds the recognizer
+    if args.bench_startup:
+        benchmark_startup(args.bench_startup)
+        sys.exit(0)
+    if args.provision:
+        sys.exit(1 if run_provisioning(args.provision, allow_unpinned=args.allow_unpinned) else 0)
+    if args.stt_load_test: # Only a client: no models needed
+        import asyncio
+        asyncio.run(run_stt_load_test(args.host or "127.0.0.1", args.port, args.stt_load_test, args.streams, args.speed))
+        sys.exit(0)
+    if args.bench_intents:
+        benchmark_intents()
+        sys.exit(0)
+    if args.check_intents:
+        load_intents()
+        sys.exit(1 if check_intents(args.check_intents) else 0)
+
+    if args.bench_conversations:
+        if args.speed <= 0:
+            parser.error("--bench-conversations needs --speed > 0")
+        check_prerequisites(stt=not args.stub_stt, tts=not args.stub_tts)
+        print("--- Initialization ---")
+        load_intents()
+        load_stt(stub=args.stub_stt)
+        start_tts(stub=args.stub_tts)
+        regressions = benchmark_conversations(args.bench_conversations, args.speed, args.baseline, args.update_baseline, args.record_output)
+        sys.exit(1 if regressions else 0)
+
+    stt_only = bool(args.batch or args.bench_front_end or args.bench_grammar or args.serve_stt)
+    tts_only = bool(args.warm_tts_cache or args.bench_tts)
+    check_prerequisites(stt=not tts_only, tts=not stt_only)
+    print("--- Initialization ---")
+    load_intents()
+    if args.batch: # The worker processes load the model themselves
+        run_batch_transcription(args.batch, args.batch_output, args.processes, args.raw_sample_rate)
+        sys.exit(0)
+    if stt_only:
+        load_stt()
+    if args.bench_front_end:
+        benchmark_front_end(args.bench_front_end)
+        sys.exit(0)
+    if args.bench_grammar:
+        benchmark_grammar(args.bench_grammar)
+        sys.exit(0)
+    if args.serve_stt:
+        import asyncio
+        try:
+            asyncio.run(serve_stt(args.host or STT_SERVER_HOST, args.port, args.threads))
+        except KeyboardInterrupt:
+            print("\nSTT server stopped.")
+        sys.exit(0)
+    if tts_only:
+        start_tts()
+    if args.warm_tts_cache:
+        warm_tts_cache()
+        sys.exit(0)
+    if args.bench_tts:
+        benchmark_tts()
+        sys.exit(0)
+
+    if sd is None:
+        print("Error: sounddevice could not load PortAudio, so there is no microphone or speaker. "
+              "Install PortAudio, or use a headless mode such as --bench-conversations.")
+        sys.exit(1)
+    # The Vosk model loads while Piper warms up: the greeting only needs TTS, and listen() waits for STT.
+    start_in_background("stt", load_stt)
+    start_in_background("tts", start_tts)
+    wait_until_ready("tts")
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port, args.metrics_host)
+    if args.metrics_jsonl:
+        start_metrics_dump(args.metrics_jsonl)
+
+    run_assistant(MicrophoneSource(), SoundCardSink())
@@ -0,0 +1,44 @@
+"""Smoke test of the conversation loop on the stub backends: no models and no sound card needed.
+
+Run with: python -m unittest test_conversation
+"""
+import os
+import unittest
+from unittest import mock
+
+import assistant_fr
+
+CONVERSATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations", "it_support")
+
+
+def setUpModule():
+    assistant_fr.load_intents()
+    assistant_fr.load_stt(stub=True)
+    assistant_fr.start_tts(stub=True)
+
+
+def tearDownModule():
+    assistant_fr.tts_engine.close()
+
+
+class ConversationLoopTest(unittest.TestCase):
+
+    def test_scripted_conversation_is_answered_turn_by_turn(self):
+        script = assistant_fr.load_labelled_set(CONVERSATION_DIR)
+        self.assertTrue(script)
+        assistant_fr.stt_front_end.recognizer.transcripts.extend(text for _, text in script)
+        assistant_fr.metrics.turn_log = []
+        self.addCleanup(setattr, assistant_fr.metrics, "turn_log", None)
+        source = assistant_fr.WavReplaySource([path for path, _ in script], speed=10)
+        with mock.patch.object(assistant_fr, "speak", wraps=assistant_fr.speak) as speak:
+            assistant_fr.run_assistant(source, assistant_fr.NullSink(speed=10))
+        spoken = [call.args[0] for call in speak.call_args_list]
+        expected = [assistant_fr.GREETING_RESPONSE] + [assistant_fr.process_command(text) for _, text in script]
+        self.assertEqual(spoken, expected)
+        self.assertEqual(len(assistant_fr.metrics.turn_log), len(script))
+        for turn in assistant_fr.metrics.turn_log:
+            self.assertLess(turn["endpoint"], turn["playback_start"])
+
+
+if __name__ == "__main__":
+    unittest.main()
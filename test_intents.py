@@ -0,0 +1,43 @@
+"""Routing regression tests for the intent table.
+
+Run with: python -m unittest test_intents
+"""
+import json
+import random
+import unittest
+
+import assistant_fr
+
+
+def setUpModule():
+    assistant_fr.load_intents()
+
+
+class IntentRoutingTest(unittest.TestCase):
+
+    def test_corpus_routes_as_expected(self):
+        self.assertEqual(assistant_fr.check_intents(), 0)
+
+    def test_matcher_agrees_with_linear_scan(self):
+        table = assistant_fr.load_intent_table(assistant_fr.INTENTS_PATH)
+        ordered = sorted(table["intents"], key=lambda entry: entry.get("priority", 0))
+        keywords = sorted({keyword for entry in table["intents"] for keyword in entry.get("any", [])}
+                          | {keyword for entry in table["intents"] for group in entry.get("all", []) for keyword in group})
+        phrases = [phrase for entry in table["intents"] for phrase in entry.get("equals", [])]
+        with open(assistant_fr.INTENTS_CORPUS_PATH, 'r', encoding='utf-8') as corpus:
+            commands = [json.loads(line)["command"] for line in corpus if line.strip()]
+        rng = random.Random(0)
+        filler = ["le", "mon", "est", "cassé", "depuis", "hier", "svp"]
+        for _ in range(5000):
+            words = rng.sample(keywords, rng.randint(1, 3)) + rng.sample(filler, rng.randint(0, 2))
+            rng.shuffle(words)
+            commands.append(" ".join(words))
+        commands.extend(phrases)
+        matcher = assistant_fr.intent_matcher
+        for command in commands:
+            intent, _ = matcher.match(command)
+            self.assertEqual(intent.name if intent else None, assistant_fr._route_linearly(ordered, command), command)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+"""Tests for --provision against a local HTTP server standing in for the model hosts.
+
+Run with: python -m unittest test_provisioning
+"""
+import hashlib
+import http.server
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import assistant_fr
+
+
+class ArtifactHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the server's in-memory blobs, with Range support and scripted failures."""
+
+    def do_GET(self):
+        server = self.server
+        blob = server.blobs.get(self.path)
+        if blob is None:
+            self.send_error(404)
+            return
+        range_header = self.headers.get("Range")
+        server.requests.append((self.path, range_header))
+        start = int(range_header.split("=")[1].rstrip("-")) if range_header else 0
+        if start >= len(blob) and range_header:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(blob)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(206 if range_header else 200)
+        if range_header:
+            self.send_header("Content-Range", f"bytes {start}-{len(blob) - 1}/{len(blob)}")
+        self.send_header("Content-Length", str(len(blob) - start))
+        self.end_headers()
+        body = blob[start:]
+        cut = server.cut_first.pop(self.path, None)
+        if cut is not None: # Drop the connection part-way through
+            self.wfile.write(body[:cut])
+            self.close_connection = True
+            return
+        hold = server.holds.get(self.path)
+        if hold is not None: # Stop part-way until the client has made progress, then send the rest
+            offset, condition = hold
+            self.wfile.write(body[:offset])
+            self.wfile.flush()
+            deadline = time.monotonic() + 10
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            server.held[self.path] = condition()
+            body = body[offset:]
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_tar_gz(members):
+    """A .tar.gz holding `members`, a dict of archive path -> bytes."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class ProvisioningTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ArtifactHandler)
+        self.server.blobs = {}
+        self.server.requests = []
+        self.server.cut_first = {}
+        self.server.holds = {}
+        self.server.held = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.old_cwd = os.getcwd()
+        self.work_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.work_dir.name) # Artifacts are provisioned relative to the working directory
+        patcher = mock.patch.object(assistant_fr, "DOWNLOAD_CHUNK_BYTES", 64 * 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        self.work_dir.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve(self, name, blob):
+        self.server.blobs["/" + name] = blob
+        return f"{self.base_url}/{name}"
+
+    def write_manifest(self, artifacts):
+        with open("manifest.json", "w", encoding="utf-8") as f:
+            json.dump({"artifacts": artifacts}, f)
+        return "manifest.json"
+
+    def test_interrupted_download_resumes_with_range(self):
+        blob = os.urandom(1024 * 1024)
+        url = self.serve("voice.onnx", blob)
+        self.server.cut_first["/voice.onnx"] = 768 * 1024
+        self.assertTrue(assistant_fr.download_file(url, "voice.onnx", hashlib.sha256(blob).hexdigest()))
+        with open("voice.onnx", "rb") as f:
+            self.assertEqual(f.read(), blob)
+        self.assertFalse(os.path.exists("voice.onnx.part"))
+        ranges = [range_header for _, range_header in self.server.requests]
+        self.assertIsNone(ranges[0])
+        self.assertEqual(len(ranges), 2)
+        offset = int(ranges[1].split("=")[1].rstrip("-"))
+        self.assertTrue(0 < offset <= 768 * 1024, ranges[1]) # Only the missing tail was fetched again
+
+    def test_oversized_partial_download_is_discarded(self):
+        blob = os.urandom(64 * 1024)
+        url = self.serve("voice.onnx", blob)
+        with open("voice.onnx.part", "wb") as f:
+            f.write(blob + b"garbage") # The server answers 416: nothing left past its end
+        self.assertTrue(assistant_fr.download_file(url, "voice.onnx"))
+        with open("voice.onnx", "rb") as f:
+            self.assertEqual(f.read(), blob)
+        self.assertEqual([range_header for _, range_header in self.server.requests], [f"bytes={len(blob) + 7}-", None])
+
+    def test_complete_partial_download_is_kept(self):
+        blob = os.urandom(64 * 1024)
+        url = self.serve("voice.onnx", blob)
+        with open("voice.onnx.part", "wb") as f:
+            f.write(blob)
+        self.assertTrue(assistant_fr.download_file(url, "voice.onnx", hashlib.sha256(blob).hexdigest()))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_tar_is_extracted_while_downloading(self):
+        archive = make_tar_gz({"piper/espeak-ng-data": b"phonemes", "piper/piper": os.urandom(512 * 1024)})
+        url = self.serve("piper_test.tar.gz", archive)
+        first_member = os.path.join(self.work_dir.name, "piper_test.partial", "piper", "espeak-ng-data")
+        # The server stalls after 256 KiB until the first member has been extracted.
+        self.server.holds["/piper_test.tar.gz"] = (256 * 1024, lambda: os.path.exists(first_member))
+        entry = {"name": "piper", "url": url, "sha256": hashlib.sha256(archive).hexdigest(),
+                 "extract_to": "piper_test", "creates": "piper_test/piper/piper"}
+        self.assertTrue(assistant_fr.provision_artifact(entry))
+        self.assertTrue(self.server.held["/piper_test.tar.gz"])
+        self.assertTrue(os.path.isfile("piper_test/piper/piper"))
+        self.assertFalse(os.path.exists("piper_test.partial"))
+        self.assertFalse(os.path.exists("piper_test.tar.gz"))
+
+    def test_interrupted_tar_download_resumes_and_extracts(self):
+        payload = os.urandom(512 * 1024)
+        archive = make_tar_gz({"piper/piper": payload})
+        url = self.serve("piper_test.tar.gz", archive)
+        self.server.cut_first["/piper_test.tar.gz"] = 300 * 1024
+        entry = {"name": "piper", "url": url, "sha256": hashlib.sha256(archive).hexdigest(),
+                 "extract_to": "piper_test", "creates": "piper_test/piper/piper"}
+        self.assertTrue(assistant_fr.provision_artifact(entry))
+        self.assertIsNotNone(self.server.requests[-1][1]) # The retry asked for the rest only
+        with open("piper_test/piper/piper", "rb") as f:
+            self.assertEqual(f.read(), payload)
+
+    def test_sha256_mismatch_is_rejected(self):
+        url = self.serve("voice.onnx", b"not the voice we pinned")
+        self.assertFalse(assistant_fr.download_file(url, "voice.onnx", "0" * 64))
+        self.assertFalse(os.path.exists("voice.onnx"))
+        self.assertFalse(os.path.exists("voice.onnx.part"))
+
+    def test_sha256_mismatch_leaves_no_extracted_archive(self):
+        url = self.serve("piper_test.tar.gz", make_tar_gz({"piper/piper": b"binary"}))
+        entry = {"name": "piper", "url": url, "sha256": "0" * 64,
+                 "extract_to": "piper_test", "creates": "piper_test/piper/piper"}
+        self.assertFalse(assistant_fr.provision_artifact(entry))
+        self.assertFalse(os.path.exists("piper_test"))
+        self.assertFalse(os.path.exists("piper_test.partial"))
+
+    def test_rerun_skips_provisioned_artifacts(self):
+        voice = os.urandom(64 * 1024)
+        archive = make_tar_gz({"piper/piper": b"binary"})
+        manifest = self.write_manifest([
+            {"name": "voice", "url": self.serve("voice.onnx", voice), "sha256": hashlib.sha256(voice).hexdigest(),
+             "path": "voice.onnx"},
+            {"name": "piper", "url": self.serve("piper_test.tar.gz", archive), "sha256": hashlib.sha256(archive).hexdigest(),
+             "extract_to": "piper_test", "creates": "piper_test/piper/piper"},
+        ])
+        self.assertEqual(assistant_fr.run_provisioning(manifest), 0)
+        requests_made = len(self.server.requests)
+        self.assertEqual(requests_made, 2)
+        self.assertEqual(assistant_fr.run_provisioning(manifest), 0)
+        self.assertEqual(len(self.server.requests), requests_made)
+
+    def test_unpinned_artifacts_need_opt_in(self):
+        manifest = self.write_manifest([{"name": "voice", "url": self.serve("voice.onnx", b"voice"), "sha256": None,
+                                         "path": "voice.onnx"}])
+        self.assertEqual(assistant_fr.run_provisioning(manifest), 1)
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(assistant_fr.run_provisioning(manifest, allow_unpinned=True), 0)
+        self.assertTrue(os.path.isfile("voice.onnx"))
+
+
+class ManifestTest(unittest.TestCase):
+
+    def test_piper_executable_matches_manifest(self):
+        piper = [entry for entry in assistant_fr.load_manifest() if entry["name"].startswith("piper")]
+        if not piper:
+            self.skipTest(f"no Piper build in the manifest for {sys.platform}")
+        self.assertEqual([entry["creates"] for entry in piper], [assistant_fr.PIPER_EXE_PATH])
+
+
+if __name__ == "__main__":
+    unittest.main()